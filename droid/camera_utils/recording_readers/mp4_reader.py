@@ -1,16 +1,88 @@
 import json
 import os
-from copy import deepcopy
+import threading
+from functools import partial
 
 import cv2
+import numpy as np
 
-resize_func_map = {"cv2": cv2.resize, None: None}
+# "cv2_area" Averages Source Pixels, Which Avoids Aliasing When Shrinking Frames Several Times Over #
+resize_func_map = {"cv2": cv2.resize, "cv2_area": partial(cv2.resize, interpolation=cv2.INTER_AREA), None: None}
+
+
+def compute_keyframe_indices(filepath):
+    # Stream Packets Without Decoding, Recording Which Ones Are Keyframes #
+    if not hasattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME"):
+        return [0]
+    packet_reader = cv2.VideoCapture(filepath, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    keyframe_indices, index = [], 0
+
+    while packet_reader.grab():
+        if packet_reader.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            keyframe_indices.append(index)
+        index += 1
+
+    packet_reader.release()
+    return sorted({0, *keyframe_indices})
+
+
+def load_keyframe_indices(filepath):
+    # Use Cached Index If It Is Newer Than The Video (Recomputing It If The File Is Unreadable) #
+    keyframe_filepath = filepath[:-4] + "_keyframes.json"
+    try:
+        if os.path.getmtime(keyframe_filepath) >= os.path.getmtime(filepath):
+            with open(keyframe_filepath, "r") as jsonFile:
+                return json.load(jsonFile)
+    except (OSError, ValueError):
+        pass
+
+    # Otherwise Compute And Cache It, Atomically Since Several Workers May Open The Same Video #
+    keyframe_indices = compute_keyframe_indices(filepath)
+    temp_filepath = "{0}.{1}.{2}.tmp".format(keyframe_filepath, os.getpid(), threading.get_ident())
+    try:
+        with open(temp_filepath, "w") as jsonFile:
+            json.dump(keyframe_indices, jsonFile)
+        os.replace(temp_filepath, keyframe_filepath)
+    except OSError:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+
+    return keyframe_indices
+
+
+def align_timestamps(recording_timestamps, query_timestamps, tolerance=0):
+    """
+    Maps each query timestamp to the index of the recorded frame with the nearest timestamp, in one vectorized pass.
+    Queries with no recorded frame within `tolerance` (same units as the timestamps) map to -1.
+    """
+    recording_timestamps = np.asarray(recording_timestamps)
+    query_timestamps = np.asarray(query_timestamps)
+    if not len(recording_timestamps):
+        return np.full(query_timestamps.shape, -1, dtype=int)
+
+    # Binary Search Against Sorted Timestamps, Comparing Neighbours On Both Sides #
+    order = np.argsort(recording_timestamps, kind="stable")
+    sorted_timestamps = recording_timestamps[order]
+    right = np.clip(np.searchsorted(sorted_timestamps, query_timestamps), 0, len(sorted_timestamps) - 1)
+    left = np.clip(right - 1, 0, None)
+
+    left_error = np.abs(query_timestamps - sorted_timestamps[left])
+    right_error = np.abs(query_timestamps - sorted_timestamps[right])
+    nearest = np.where(left_error < right_error, left, right)
+    error = np.minimum(left_error, right_error)
+
+    return np.where(error <= tolerance, order[nearest], -1)
 
 
 class MP4Reader:
-    def __init__(self, filepath, serial_number):
+    def __init__(self, filepath, serial_number, seek_cost=8):
         # Save Parameters #
         self.serial_number = serial_number
+        self._filepath = filepath
+        self._seek_cost = seek_cost
+        self._keyframe_indices = None
+        self._frame_buffer = None
+        self._output_buffers = {}
         self._index = 0
 
         # Open Video Reader #
@@ -21,10 +93,10 @@ class MP4Reader:
 
         # Load Recording Timestamps #
         timestamp_filepath = filepath[:-4] + "_timestamps.json"
-        if not os.path.isfile(timestamp_filepath):
-            self._recording_timestamps = []
-        with open(timestamp_filepath, "r") as jsonFile:
-            self._recording_timestamps = json.load(jsonFile)
+        self._recording_timestamps = np.array([], dtype=np.int64)
+        if os.path.isfile(timestamp_filepath):
+            with open(timestamp_filepath, "r") as jsonFile:
+                self._recording_timestamps = np.array(json.load(jsonFile), dtype=np.int64)
 
     def set_reading_parameters(
         self,
@@ -32,54 +104,104 @@ class MP4Reader:
         concatenate_images=False,
         resolution=(0, 0),
         resize_func=None,
+        reuse_buffers=False,
     ):
+        """
+        - reuse_buffers: read_camera writes frames into output arrays that are reused across calls, so its frames are
+          only valid until the next read (copy them to keep them). read_frames always returns new arrays
+        """
         # Save Parameters #
         self.image = image
         self.concatenate_images = concatenate_images
         self.resolution = resolution
         self.resize_func = resize_func_map[resize_func]
+        self.reuse_buffers = reuse_buffers
+        self._output_buffers = {}
         self.skip_reading = not image
         if self.skip_reading:
             return
 
     def get_frame_resolution(self):
-        width = self._mp4_reader.get(cv2.cv.CV_CAP_PROP_FRAME_WIDTH)
-        height = self._mp4_reader.get(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT)
+        width = self._mp4_reader.get(cv2.CAP_PROP_FRAME_WIDTH)
+        height = self._mp4_reader.get(cv2.CAP_PROP_FRAME_HEIGHT)
         return (width, height)
 
     def get_frame_count(self):
         if self.skip_reading:
             return 0
-        frame_count = int(self._mp4_reader.get(cv2.cv.CV_CAP_PROP_FRAME_COUNT))
+        frame_count = int(self._mp4_reader.get(cv2.CAP_PROP_FRAME_COUNT))
         return frame_count
 
+    def get_keyframe_indices(self):
+        if self._keyframe_indices is None:
+            self._keyframe_indices = np.array(load_keyframe_indices(self._filepath))
+        return self._keyframe_indices
+
+    def get_frame_indices(self, timestamps, tolerance=0):
+        # Returns None If The Recording Has No Timestamps To Align Against #
+        if not len(self._recording_timestamps):
+            return None
+        return align_timestamps(self._recording_timestamps, timestamps, tolerance=tolerance)
+
     def set_frame_index(self, index):
-        if self.skip_reading:
+        if self.skip_reading or (index == self._index):
             return
 
-        if index < self._index:
-            self._mp4_reader.set(cv2.CAP_PROP_POS_FRAMES, index - 1)
-            self._index = index
+        # Find Nearest Keyframe At Or Before Target #
+        keyframe_indices = self.get_keyframe_indices()
+        keyframe = keyframe_indices[np.searchsorted(keyframe_indices, index, side="right") - 1]
+
+        # Seek Only If It Beats Decoding Forward From Here (Seek Cost Is In Frames) #
+        skip_cost = (index - self._index) if (index > self._index) else np.inf
+        seek_cost = self._seek_cost + (index - keyframe)
+        if seek_cost < skip_cost:
+            self._mp4_reader.set(cv2.CAP_PROP_POS_FRAMES, int(keyframe))
+            self._index = int(keyframe)
 
         while self._index < index:
-            self.read_camera(ignore_data=True)
+            self._mp4_reader.grab()
+            self._index += 1
 
-    def _process_frame(self, frame):
-        frame = deepcopy(frame)
+    def _process_frame(self, frame, out=None):
+        # Frame Is A View Into The Decode Buffer, So Copy Or Resize It Into The Output #
         if self.resolution == (0, 0):
-            return frame
-        return self.resize_func(frame, self.resolution)
+            if out is None:
+                return frame.copy()
+            np.copyto(out, frame)
+            return out
+
+        resized_frame = self.resize_func(frame, self.resolution, dst=out)
+        if (out is not None) and (resized_frame is not out):
+            np.copyto(out, resized_frame)
+            return out
+        return resized_frame
         # return cv2.resize(frame, self.resolution)#, interpolation=cv2.INTER_AREA)
 
-    def read_camera(self, ignore_data=False, correct_timestamp=None, return_timestamp=False):
+    def _process_image(self, key, frame, buffer_dict):
+        # Caller Buffers Belong To The Caller, So They Never Become Reused Buffers #
+        if key in buffer_dict:
+            return self._process_frame(frame, out=buffer_dict[key])
+
+        out = self._output_buffers.get(key, None) if self.reuse_buffers else None
+        processed_frame = self._process_frame(frame, out=out)
+        if self.reuse_buffers:
+            self._output_buffers[key] = processed_frame
+        return processed_frame
+
+    def read_camera(self, ignore_data=False, correct_timestamp=None, return_timestamp=False, buffer_dict={}):
+        """
+        - buffer_dict: Optional preallocated output arrays per image key, which frames are written into in place
+        """
         # Skip if Read Unnecesary #
         if self.skip_reading:
             return {}
 
-        # Read Camera #
-        success, frame = self._mp4_reader.read()
+        # Read Camera (Decoding Into The Same Buffer Every Call) #
+        success, frame = self._mp4_reader.read(self._frame_buffer)
+        if success:
+            self._frame_buffer = frame
         try:
-            received_time = self._recording_timestamps[self._index]
+            received_time = int(self._recording_timestamps[self._index])
         except IndexError:
             received_time = None
 
@@ -99,18 +221,51 @@ class MP4Reader:
         data_dict = {}
 
         if self.concatenate_images:
-            data_dict["image"] = {self.serial_number: self._process_frame(frame)}
+            data_dict["image"] = {self.serial_number: self._process_image(self.serial_number, frame, buffer_dict)}
         else:
+            # Stereo Halves Are Views, Resized Straight From The Decode Buffer #
             single_width = frame.shape[1] // 2
+            left_key, right_key = self.serial_number + "_left", self.serial_number + "_right"
             data_dict["image"] = {
-                self.serial_number + "_left": self._process_frame(frame[:, :single_width, :]),
-                self.serial_number + "_right": self._process_frame(frame[:, single_width:, :]),
+                left_key: self._process_image(left_key, frame[:, :single_width, :], buffer_dict),
+                right_key: self._process_image(right_key, frame[:, single_width:, :], buffer_dict),
             }
 
         if return_timestamp:
             return data_dict, received_time
         return data_dict
 
+    def read_frames(self, indices, correct_timestamps=None):
+        """
+        Reads the frames at `indices` in one monotonic pass, returning {"image": {image key: (N, H, W, C) frames}}.
+        - Indices are sorted and deduplicated, and frames come back in that order
+        - correct_timestamps, if given, must be aligned with the sorted indices
+        - Reading stops at the first frame that fails, so N may be smaller than the number of indices
+        - Frames are copied into arrays allocated for this call, so they stay valid even with reuse_buffers
+        """
+        if self.skip_reading:
+            return {}
+
+        indices = np.unique(np.asarray(indices, dtype=int))
+        frame_dict, num_read = {}, 0
+
+        for i, index in enumerate(indices):
+            self.set_frame_index(index)
+            timestamp = None if correct_timestamps is None else correct_timestamps[i]
+            buffer_dict = {key: frames[i] for key, frames in frame_dict.items()}
+            data_dict = self.read_camera(correct_timestamp=timestamp, buffer_dict=buffer_dict)
+            if data_dict is None:
+                break
+
+            # Preallocate Outputs From The First Frame, Later Frames Are Written In Place #
+            if not frame_dict:
+                for key, frame in data_dict.get("image", {}).items():
+                    frame_dict[key] = np.empty((len(indices), *frame.shape), dtype=frame.dtype)
+                    frame_dict[key][0] = frame
+            num_read += 1
+
+        return {"image": {key: frames[:num_read] for key, frames in frame_dict.items()}}
+
     def disable_camera(self):
         if hasattr(self, "_mp4_reader"):
             self._mp4_reader.release()
@@ -1,13 +1,16 @@
+from collections import defaultdict
 from copy import deepcopy
+from functools import partial
 
 import cv2
+import numpy as np
 
 try:
     import pyzed.sl as sl
 except ModuleNotFoundError:
     print("WARNING: You have not setup the ZED cameras, and currently cannot use them")
 
-resize_func_map = {"cv2": cv2.resize, None: None}
+resize_func_map = {"cv2": cv2.resize, "cv2_area": partial(cv2.resize, interpolation=cv2.INTER_AREA), None: None}
 
 
 class SVOReader:
@@ -143,6 +146,30 @@ class SVOReader:
             return data_dict, received_time
         return data_dict
 
+    def read_frames(self, indices, correct_timestamps=None):
+        """
+        Reads the frames at `indices` in one monotonic pass, returning {"image": {image key: (N, H, W, C) frames}}.
+        - Indices are sorted and deduplicated, and frames come back in that order
+        - correct_timestamps, if given, must be aligned with the sorted indices
+        - Reading stops at the first frame that fails, so N may be smaller than the number of indices
+        """
+        if self.skip_reading:
+            return {}
+
+        indices = np.unique(np.asarray(indices, dtype=int))
+        frame_dict = defaultdict(list)
+
+        for i, index in enumerate(indices):
+            self.set_frame_index(index)
+            timestamp = None if correct_timestamps is None else correct_timestamps[i]
+            data_dict = self.read_camera(correct_timestamp=timestamp)
+            if data_dict is None:
+                break
+            for key, frame in data_dict.get("image", {}).items():
+                frame_dict[key].append(frame)
+
+        return {"image": {key: np.stack(frames) for key, frames in frame_dict.items()}}
+
     def disable_camera(self):
         if hasattr(self, "_cam"):
             self._cam.close()
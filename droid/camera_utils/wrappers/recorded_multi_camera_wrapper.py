@@ -1,6 +1,9 @@
 import glob
 import random
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 from droid.camera_utils.info import get_camera_type
 from droid.camera_utils.recording_readers.mp4_reader import MP4Reader
@@ -8,16 +11,21 @@ from droid.camera_utils.recording_readers.svo_reader import SVOReader
 
 
 class RecordedMultiCameraWrapper:
-    def __init__(self, recording_folderpath, camera_kwargs={}):
+    def __init__(self, recording_folderpath, camera_kwargs={}, frame_cache=None):
+        """
+        - frame_cache: Optional FrameCache (see droid.data_loading.frame_cache), which read_frames uses to decode each
+          camera file once and memory-map the frames afterwards
+        """
         # Save Camera Info #
         self.camera_kwargs = camera_kwargs
+        self.frame_cache = frame_cache
 
         # Open Camera Readers #
         svo_filepaths = glob.glob(recording_folderpath + "/*.svo")
         mp4_filepaths = glob.glob(recording_folderpath + "/*.mp4")
         all_filepaths = svo_filepaths + mp4_filepaths
 
-        self.camera_dict = {}
+        self.camera_dict, self.camera_filepaths = {}, {}
         for f in all_filepaths:
             serial_number = f.split("/")[-1][:-4]
             cam_type = get_camera_type(serial_number)
@@ -31,6 +39,7 @@ class RecordedMultiCameraWrapper:
                 raise ValueError
 
             self.camera_dict[serial_number] = Reader(f, serial_number)
+            self.camera_filepaths[serial_number] = f
 
     def read_cameras(self, index=None, camera_type_dict={}, timestamp_dict={}):
         full_obs_dict = defaultdict(dict)
@@ -58,6 +67,122 @@ class RecordedMultiCameraWrapper:
 
         return full_obs_dict
 
+    def align_frames(self, indices, timestamp_dict={}, tolerance=0):
+        """
+        Maps timesteps to frame indices for every camera, using each recording's timestamp index (-1 where a camera
+        has no frame within `tolerance` ms of the "<serial>_frame_received" timestamp).
+        - Cameras without a timestamp index (ex: SVO files) or without timestamps are left out
+        """
+        frame_index_dict = {}
+
+        for cam_id, camera in self.camera_dict.items():
+            timestamps = timestamp_dict.get(cam_id + "_frame_received", None)
+            if (timestamps is None) or not hasattr(camera, "get_frame_indices"):
+                continue
+            frame_indices = camera.get_frame_indices(timestamps, tolerance=tolerance)
+            if frame_indices is not None:
+                frame_index_dict[cam_id] = frame_indices
+
+        return frame_index_dict
+
+    def get_keep_mask(self, indices, camera_type_dict={}, timestamp_dict={}, timestamp_tolerance=0):
+        """
+        Predicts read_frames' keep_mask from timestamps and frame counts alone, without decoding anything.
+        - Cameras read without a timestamp index can still miss frames on a timestamp mismatch, which only decoding
+          reveals, so for them only the frame count is checked
+        """
+        indices = np.asarray(indices, dtype=int)
+        frame_index_dict = self.align_frames(indices, timestamp_dict=timestamp_dict, tolerance=timestamp_tolerance)
+        keep_mask = np.ones(len(indices), dtype=bool)
+
+        for cam_id, camera in self.camera_dict.items():
+            camera.set_reading_parameters(**self.camera_kwargs.get(camera_type_dict[cam_id], {}))
+            if camera.skip_reading:
+                continue
+            frame_indices = frame_index_dict.get(cam_id, indices)
+            keep_mask &= (frame_indices >= 0) & (frame_indices < camera.get_frame_count())
+
+        return keep_mask
+
+    def read_frames(self, indices, camera_type_dict={}, timestamp_dict={}, timestamp_tolerance=0):
+        """
+        Reads the frames for each timestep in `indices` from every camera, with one monotonic pass per camera file and
+        each file decoded in its own thread. Returns ({"image": {image key: (N, H, W, C) frames}}, keep_mask).
+        - timestamp_dict optionally maps "<serial>_frame_received" to timestamps aligned with `indices`
+        - Timesteps are matched to the nearest frame within timestamp_tolerance ms (0 requires an exact match)
+        - keep_mask marks the timesteps every camera returned a frame for, which are the N frames returned
+        - With a frame cache, cameras are decoded in full once and later reads index into the cached frames (cameras
+          that still need frame by frame timestamp checks bypass the cache)
+        """
+        indices = np.asarray(indices, dtype=int)
+        frame_index_dict = self.align_frames(indices, timestamp_dict=timestamp_dict, tolerance=timestamp_tolerance)
+        camera_obs, camera_positions = {}, {}
+
+        def read_camera_frames(cam_id):
+            cam_type = camera_type_dict[cam_id]
+            curr_cam_kwargs = self.camera_kwargs.get(cam_type, {})
+            camera = self.camera_dict[cam_id]
+            camera.set_reading_parameters(**curr_cam_kwargs)
+
+            # Read Each Matched Frame Once #
+            aligned = cam_id in frame_index_dict
+            frame_indices = frame_index_dict[cam_id] if aligned else indices
+            valid = frame_indices >= 0
+            unique_frames, first, inverse = np.unique(frame_indices[valid], return_index=True, return_inverse=True)
+
+            # Unaligned Cameras Still Check Timestamps Frame By Frame #
+            timestamps = timestamp_dict.get(cam_id + "_frame_received", None)
+            correct_timestamps = None if (aligned or timestamps is None) else np.asarray(timestamps)[valid][first]
+            use_cache = (self.frame_cache is not None) and (correct_timestamps is None) and not camera.skip_reading
+
+            if use_cache:
+                camera_obs[cam_id] = self._read_cached_frames(cam_id, unique_frames, curr_cam_kwargs)
+            else:
+                camera_obs[cam_id] = camera.read_frames(unique_frames, correct_timestamps=correct_timestamps)
+
+            positions = np.full(len(indices), -1)
+            positions[valid] = inverse
+            camera_positions[cam_id] = positions
+
+        # Errors In Any Camera Thread Are Raised Here, Instead Of Silently Dropping That Camera #
+        with ThreadPoolExecutor(max_workers=max(len(self.camera_dict), 1)) as executor:
+            futures = [executor.submit(read_camera_frames, cam_id) for cam_id in self.camera_dict]
+            [future.result() for future in futures]
+
+        # Keep Only Timesteps Every Camera Could Read #
+        keep_mask = np.ones(len(indices), dtype=bool)
+        for cam_id, data_dict in camera_obs.items():
+            if not data_dict:
+                continue
+            # Cameras Without A Single Aligned Frame Return No Image Keys At All #
+            num_read = min([len(frames) for obs_dict in data_dict.values() for frames in obs_dict.values()], default=0)
+            positions = camera_positions[cam_id]
+            keep_mask &= (positions >= 0) & (positions < num_read)
+
+        # Merge Cameras #
+        full_obs_dict = defaultdict(dict)
+        for cam_id, data_dict in camera_obs.items():
+            positions = camera_positions[cam_id][keep_mask]
+            for key in data_dict:
+                for image_key, frames in data_dict[key].items():
+                    full_obs_dict[key][image_key] = frames[positions]
+
+        return full_obs_dict, keep_mask
+
+    def _read_cached_frames(self, cam_id, frame_indices, reading_kwargs):
+        camera = self.camera_dict[cam_id]
+
+        def decode_all_frames():
+            all_frame_indices = np.arange(camera.get_frame_count())
+            return camera.read_frames(all_frame_indices).get("image", {})
+
+        image_dict = self.frame_cache.load_or_decode(self.camera_filepaths[cam_id], reading_kwargs, decode_all_frames)
+
+        # Frames Past The End Of The Recording Count As Failed Reads #
+        num_frames = min([len(frames) for frames in image_dict.values()], default=0)
+        frame_indices = frame_indices[: np.searchsorted(frame_indices, num_frames)]
+        return {"image": {image_key: frames[frame_indices] for image_key, frames in image_dict.items()}}
+
     def disable_cameras(self):
         for camera in self.camera_dict.values():
             camera.disable_camera()
@@ -1,7 +1,7 @@
 from torch.utils.data import DataLoader
 from torch.utils.data.datapipes.iter import Shuffler
 
-from droid.data_loading.dataset import TrajectoryDataset
+from droid.data_loading.dataset import TimestepDataset, TrajectoryDataset, collate_timesteps
 from droid.data_loading.trajectory_sampler import *
 
 
@@ -16,7 +16,16 @@ def create_dataloader(
     timestep_filtering_kwargs={},
     camera_kwargs={},
     image_transform_kwargs={},
+    frame_cache_kwargs=None,
+    weight_by_length=False,
+    map_style=False,
+    index_filepath=None,
+    sampler=None,
 ):
+    """
+    - map_style: Sample individual timesteps from a global timestep index (cached at index_filepath, if given) instead
+      of streaming whole trajectories through a shuffle buffer. A custom sampler (ex: DistributedSampler) may be given
+    """
     traj_sampler = TrajectorySampler(
         data_folderpaths,
         recording_prefix=recording_prefix,
@@ -24,7 +33,22 @@ def create_dataloader(
         timestep_filtering_kwargs=timestep_filtering_kwargs,
         image_transform_kwargs=image_transform_kwargs,
         camera_kwargs=camera_kwargs,
+        frame_cache_kwargs=frame_cache_kwargs,
+        weight_by_length=weight_by_length,
     )
+    if map_style:
+        dataset = TimestepDataset(traj_sampler, index_filepath=index_filepath)
+        dataloader = DataLoader(
+            dataset,
+            batch_size=batch_size,
+            shuffle=sampler is None,
+            sampler=sampler,
+            num_workers=num_workers,
+            prefetch_factor=prefetch_factor,
+            collate_fn=collate_timesteps,
+        )
+        return dataloader
+
     dataset = TrajectoryDataset(traj_sampler)
     shuffled_dataset = Shuffler(dataset, buffer_size=buffer_size)
     dataloader = DataLoader(
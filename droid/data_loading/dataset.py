@@ -1,5 +1,5 @@
 import torch
-from torch.utils.data import IterableDataset
+from torch.utils.data import Dataset, IterableDataset
 
 
 class TrajectoryDataset(IterableDataset):
@@ -18,3 +18,27 @@ class TrajectoryDataset(IterableDataset):
                 yield next(self._sample_generator)
             except StopIteration:
                 self._refresh_generator()
+
+
+class TimestepDataset(Dataset):
+    """
+    Map-style dataset over a global (trajectory, timestep) index, so standard samplers (including DistributedSampler)
+    shuffle individual timesteps. Each item loads only its own timestep, and the index can be cached to disk.
+    - The index only holds timesteps every camera has a frame for, so an item is never swapped for another one
+    """
+
+    def __init__(self, trajectory_sampler, index_filepath=None):
+        self._trajectory_sampler = trajectory_sampler
+        self._traj_ids, self._timesteps = trajectory_sampler.load_timestep_index(index_filepath=index_filepath)
+
+    def __len__(self):
+        return len(self._timesteps)
+
+    def __getitem__(self, index):
+        # Returns None For The Rare Timestep Whose Frames Could Not Be Decoded (see collate_timesteps) #
+        return self._trajectory_sampler.fetch_timestep(self._traj_ids[index], self._timesteps[index])
+
+
+def collate_timesteps(batch):
+    # Drops Timesteps TimestepDataset Could Not Load, Rather Than Substituting Other Samples #
+    return torch.utils.data.default_collate([timestep for timestep in batch if timestep is not None])
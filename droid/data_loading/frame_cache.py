@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import uuid
+
+import numpy as np
+
+ENTRY_INFO_FILENAME = "entry_info.json"
+
+
+def get_free_bytes(path):
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return 0
+
+
+def get_default_cache_dir(min_shm_bytes=2**30):
+    # Prefer Shared Memory, So Workers Map Frames Straight From RAM (Unless It Is Tiny, Like Docker's 64 MB Default) #
+    if os.path.isdir("/dev/shm") and get_free_bytes("/dev/shm") >= min_shm_bytes:
+        return "/dev/shm/droid_frame_cache"
+    return os.path.join(tempfile.gettempdir(), "droid_frame_cache")
+
+
+class FrameCache:
+    """
+    Decoded (and resized) recording frames shared between processes, such as DataLoader workers. Each entry holds every
+    frame of one camera file for one set of reading parameters as memory-mapped .npy files, keyed by
+    (recording file, modification time, reading parameters). Least recently used entries are evicted once the cache
+    grows past `max_bytes`.
+    - max_bytes: Defaults to half the free space of the cache filesystem, capped at `max_default_bytes`
+    - Entries that are incomplete, being evicted, or that cannot be written (ex: a full filesystem) count as misses,
+      so callers fall back to decoding
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None, max_default_bytes=16 * 2**30):
+        self.cache_dir = get_default_cache_dir() if cache_dir is None else cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if max_bytes is None:
+            max_bytes = min(get_free_bytes(self.cache_dir) // 2, max_default_bytes)
+        self.max_bytes = max_bytes
+
+    def get_entry_path(self, filepath, reading_kwargs={}):
+        filepath = os.path.realpath(filepath)
+        entry_key = (filepath, os.path.getmtime(filepath), sorted(reading_kwargs.items()))
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(entry_key).encode()).hexdigest())
+
+    def load(self, filepath, reading_kwargs={}):
+        # Returns {image key: (N, H, W, C) memmap}, Or None On A Miss (Including Partially Removed Entries) #
+        entry_path = self.get_entry_path(filepath, reading_kwargs)
+        try:
+            with open(os.path.join(entry_path, ENTRY_INFO_FILENAME), "r") as jsonFile:
+                image_keys = json.load(jsonFile)["image_keys"]
+            image_dict = {
+                image_key: np.load(os.path.join(entry_path, image_key + ".npy"), mmap_mode="r")
+                for image_key in image_keys
+            }
+            os.utime(entry_path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+        return image_dict
+
+    def save(self, filepath, reading_kwargs, image_dict):
+        # Write To A Private Folder, Then Publish It With An Atomic Rename #
+        entry_path = self.get_entry_path(filepath, reading_kwargs)
+        temp_path = os.path.join(self.cache_dir, ".tmp-{0}-{1}".format(os.getpid(), uuid.uuid4().hex))
+        try:
+            os.makedirs(temp_path)
+            for image_key, frames in image_dict.items():
+                np.save(os.path.join(temp_path, image_key + ".npy"), frames)
+
+            # Written Last, So Only Complete Entries Are Ever Loaded #
+            with open(os.path.join(temp_path, ENTRY_INFO_FILENAME), "w") as jsonFile:
+                json.dump({"image_keys": sorted(image_dict)}, jsonFile)
+        except OSError:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            return None
+
+        try:
+            os.rename(temp_path, entry_path)
+        except OSError:
+            # Another Worker Published This Entry First #
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+        self.evict(keep_path=entry_path)
+        return self.load(filepath, reading_kwargs)
+
+    def load_or_decode(self, filepath, reading_kwargs, decode_func):
+        image_dict = self.load(filepath, reading_kwargs)
+        if image_dict is None:
+            image_dict = decode_func()
+            entry_bytes = sum(frames.nbytes for frames in image_dict.values())
+            cacheable = len(image_dict) and all(len(frames) for frames in image_dict.values())
+            if cacheable and (entry_bytes <= self.max_bytes):
+                image_dict = self.save(filepath, reading_kwargs, image_dict) or image_dict
+        return image_dict
+
+    def get_entries(self):
+        entries = []
+
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or entry.name.startswith(".tmp"):
+                continue
+            try:
+                entry_bytes = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, entry_bytes, entry.path))
+            except FileNotFoundError:
+                continue
+
+        return entries
+
+    def evict(self, keep_path=None):
+        # Remove Least Recently Used Entries Until We Fit The Budget #
+        entries = sorted(self.get_entries())
+        total_bytes = sum(entry_bytes for _, entry_bytes, _ in entries)
+
+        for _, entry_bytes, entry_path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            if entry_path == keep_path:
+                continue
+
+            # Unpublish The Entry Before Deleting It, So Readers Never See It Half Removed #
+            trash_path = os.path.join(self.cache_dir, ".tmp-evict-{0}".format(uuid.uuid4().hex))
+            try:
+                os.rename(entry_path, trash_path)
+            except OSError:
+                continue
+            shutil.rmtree(trash_path, ignore_errors=True)
+            total_bytes -= entry_bytes
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
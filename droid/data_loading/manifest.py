@@ -0,0 +1,198 @@
+import json
+import os
+import sqlite3
+
+import h5py
+import numpy as np
+
+from droid.trajectory_utils.trajectory_reader import HDF5Index
+
+MANIFEST_FILENAME = "manifest.sqlite"
+
+
+def to_json_value(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return value
+
+
+def read_trajectory_info(folderpath):
+    with h5py.File(os.path.join(folderpath, "trajectory.h5"), "r") as hdf5_file:
+        attrs = {key: to_json_value(value) for key, value in hdf5_file.attrs.items()}
+        length = HDF5Index(hdf5_file, keys_to_ignore=["videos"]).length() or 0
+
+        camera_type = hdf5_file.get("observation/camera_type", None)
+        cameras = {}
+        if isinstance(camera_type, h5py.Group) and length:
+            cameras = {cam_id: int(camera_type[cam_id][0]) for cam_id in camera_type}
+
+    recording_folderpath = os.path.join(folderpath, "recordings")
+    recordings = sorted(os.listdir(recording_folderpath)) if os.path.isdir(recording_folderpath) else []
+
+    return {"attrs": attrs, "length": length, "cameras": cameras, "recordings": recordings}
+
+
+class DatasetManifest:
+    """
+    SQLite index of every trajectory folder in a data tree (path, HDF5 attrs, length, cameras, recordings, mtime).
+    - update() only lists directories whose mtime changed, and only opens new or modified trajectory.h5 files
+    - query() replaces crawler(), running filter_func on the stored attrs instead of opening each file
+    - Trajectories that cannot be read are skipped (and retried on the next update)
+    """
+
+    def __init__(self, manifest_filepath):
+        self.manifest_filepath = manifest_filepath
+        self._connection = sqlite3.connect(manifest_filepath)
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS directories (
+                dirpath TEXT PRIMARY KEY, mtime REAL, subdirs TEXT, has_trajectory INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS trajectories (
+                folderpath TEXT PRIMARY KEY, mtime REAL, length INTEGER, attrs TEXT, cameras TEXT, recordings TEXT
+            );
+            CREATE TABLE IF NOT EXISTS splits (
+                split_name TEXT, folderpath TEXT, subset TEXT, PRIMARY KEY (split_name, folderpath)
+            );
+            """
+        )
+
+    def _list_directory(self, dirpath):
+        # Reuse The Cached Listing Unless Entries Were Added Or Removed #
+        dir_mtime = os.stat(dirpath).st_mtime
+        row = self._connection.execute(
+            "SELECT mtime, subdirs, has_trajectory FROM directories WHERE dirpath = ?", (dirpath,)
+        ).fetchone()
+        if (row is not None) and (row[0] == dir_mtime):
+            return json.loads(row[1]), bool(row[2])
+
+        entries = list(os.scandir(dirpath))
+        subdirs = sorted(f.path for f in entries if f.is_dir())
+        has_trajectory = any(f.is_file() and f.name == "trajectory.h5" for f in entries)
+        self._connection.execute(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?)",
+            (dirpath, dir_mtime, json.dumps(subdirs), int(has_trajectory)),
+        )
+        return subdirs, has_trajectory
+
+    def _update_trajectory(self, folderpath):
+        traj_mtime = os.stat(os.path.join(folderpath, "trajectory.h5")).st_mtime
+        row = self._connection.execute("SELECT mtime FROM trajectories WHERE folderpath = ?", (folderpath,)).fetchone()
+        if (row is not None) and (row[0] == traj_mtime):
+            return False
+
+        # Skip Trajectories That Cannot Be Indexed (ex: Datasets Of Different Lengths From An Interrupted Write) #
+        try:
+            traj_info = read_trajectory_info(folderpath)
+        except Exception as error:
+            print("Skipping unreadable trajectory:", folderpath, repr(error))
+            return False
+
+        self._connection.execute(
+            "INSERT OR REPLACE INTO trajectories VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                folderpath,
+                traj_mtime,
+                traj_info["length"],
+                json.dumps(traj_info["attrs"]),
+                json.dumps(traj_info["cameras"]),
+                json.dumps(traj_info["recordings"]),
+            ),
+        )
+        return True
+
+    def update(self, data_dir):
+        # Returns The Number Of Trajectories That Were (Re)Indexed #
+        data_dir = os.path.realpath(data_dir)
+        found_folderpaths, num_updated = set(), 0
+        dirpaths = [data_dir]
+
+        while dirpaths:
+            dirpath = dirpaths.pop()
+            subdirs, has_trajectory = self._list_directory(dirpath)
+
+            # Like crawler(), Trajectory Folders Are Not Searched Further #
+            if has_trajectory:
+                found_folderpaths.add(dirpath)
+                num_updated += self._update_trajectory(dirpath)
+            else:
+                dirpaths.extend(subdirs)
+
+        # Forget Trajectories That No Longer Exist #
+        for folderpath in self._query_folderpaths(data_dir):
+            if folderpath not in found_folderpaths:
+                self._connection.execute("DELETE FROM trajectories WHERE folderpath = ?", (folderpath,))
+
+        self._connection.commit()
+        return num_updated
+
+    def _query_folderpaths(self, data_dir):
+        prefix = os.path.join(os.path.realpath(data_dir), "")
+        rows = self._connection.execute(
+            "SELECT folderpath FROM trajectories WHERE folderpath = ? OR substr(folderpath, 1, ?) = ?",
+            (prefix[:-1], len(prefix), prefix),
+        )
+        return [row[0] for row in rows]
+
+    def get_entries(self, data_dir=None):
+        query = "SELECT folderpath, length, attrs, cameras, recordings FROM trajectories ORDER BY folderpath"
+        folderpaths = None if data_dir is None else set(self._query_folderpaths(data_dir))
+        entries = []
+
+        for folderpath, length, attrs, cameras, recordings in self._connection.execute(query):
+            if (folderpaths is not None) and (folderpath not in folderpaths):
+                continue
+            entries.append(
+                {
+                    "folderpath": folderpath,
+                    "length": length,
+                    "attrs": json.loads(attrs),
+                    "cameras": json.loads(cameras),
+                    "recordings": json.loads(recordings),
+                }
+            )
+
+        return entries
+
+    def query(self, data_dir=None, filter_func=None):
+        entries = self.get_entries(data_dir=data_dir)
+        return [entry["folderpath"] for entry in entries if (filter_func is None) or filter_func(entry["attrs"])]
+
+    def get_attrs(self, folderpaths):
+        attrs_dict = {}
+        for folderpath in folderpaths:
+            row = self._connection.execute(
+                "SELECT attrs FROM trajectories WHERE folderpath = ?", (folderpath,)
+            ).fetchone()
+            attrs_dict[folderpath] = {} if row is None else json.loads(row[0])
+        return attrs_dict
+
+    def load_split(self, split_name):
+        # Returns {folderpath: subset} For A Saved Split (Empty If It Does Not Exist) #
+        rows = self._connection.execute("SELECT folderpath, subset FROM splits WHERE split_name = ?", (split_name,))
+        return dict(rows.fetchall())
+
+    def save_split(self, split_name, split_dict):
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO splits VALUES (?, ?, ?)",
+            [(split_name, folderpath, subset) for folderpath, subset in split_dict.items()],
+        )
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+def query_manifest(data_dir, filter_func=None, manifest_filepath=None):
+    # Bring The Manifest Up To Date, Then Query It (Stored In data_dir By Default) #
+    if manifest_filepath is None:
+        manifest_filepath = os.path.join(data_dir, MANIFEST_FILENAME)
+
+    manifest = DatasetManifest(manifest_filepath)
+    manifest.update(data_dir)
+    all_folderpaths = manifest.query(data_dir, filter_func=filter_func)
+    manifest.close()
+
+    return all_folderpaths
@@ -36,7 +36,33 @@ def get_tf_dataloader(
     batch_size: int,
     shuffle_buffer_size: int = 25000,
     cache: bool = False,
+    decode_after_batching: bool = False,
+    decode_parallel_calls: int = tf.data.AUTOTUNE,
+    decode_parallel_iterations: int = 8,
+    obs_history: int = 1,
+    action_horizon: int = 1,
 ) -> tf.data.Dataset:
+    """Get a dataset of batched transitions from a directory of tfrecords.
+
+    Args:
+        path (str): Directory containing the *.tfrecord files.
+        batch_size (int): Number of transitions per batch.
+        shuffle_buffer_size (int): Number of transitions in the shuffle buffer.
+        cache (bool): Whether to cache the decoded trajectories in memory.
+        decode_after_batching (bool): Shuffle the JPEG encoded images and decode / normalize whole batches afterwards,
+            so the shuffle buffer holds compact bytes instead of float32 images. Requires every image of a key to have
+            the same shape.
+        decode_parallel_calls (int): Number of transitions (or batches, if decode_after_batching) decoded in parallel.
+        decode_parallel_iterations (int): Number of images of a batch decoded in parallel, if decode_after_batching.
+        obs_history (int): Number of stacked observation frames (current one last), for frame stacking.
+        action_horizon (int): Number of stacked actions (current one first), for action chunking.
+
+    Returns:
+        tf.data.Dataset: An infinite dataset of batched transitions, with images as float32 in [-1, 1]. If obs_history
+            or action_horizon is above 1, every observation/* or action/* value gets a window dimension after the batch
+            dimension. Windows are padded at episode boundaries by repeating the first observation / last action, and
+            "observation/pad_mask" / "action/pad_mask" mark which window entries are real.
+    """
     # get the tfrecord files
     paths = tf.io.gfile.glob(tf.io.gfile.join(path, "*.tfrecord"))
 
@@ -54,12 +80,16 @@ def get_tf_dataloader(
         dataset = dataset.cache()
 
     # do any trajectory-level transforms here (e.g. filtering, goal relabeling)
+    if obs_history > 1 or action_horizon > 1:
+        window = partial(_window_trajectory, obs_history=obs_history, action_horizon=action_horizon)
+        dataset = dataset.map(window, num_parallel_calls=tf.data.AUTOTUNE)
 
     # unbatch to get individual transitions
     dataset = dataset.unbatch()
 
-    # process each transition
-    dataset = dataset.map(_process_transition, num_parallel_calls=tf.data.AUTOTUNE)
+    # process each transition (otherwise, images stay encoded until after batching)
+    if not decode_after_batching:
+        dataset = dataset.map(_process_transition, num_parallel_calls=decode_parallel_calls)
 
     # do any transition-level transformations here (e.g. augmentations)
 
@@ -71,6 +101,11 @@ def get_tf_dataloader(
     # batch the dataset
     dataset = dataset.batch(batch_size, num_parallel_calls=tf.data.AUTOTUNE)
 
+    # decode and normalize whole batches
+    if decode_after_batching:
+        process_batch = partial(_process_batch, parallel_iterations=decode_parallel_iterations)
+        dataset = dataset.map(process_batch, num_parallel_calls=decode_parallel_calls)
+
     # always prefetch last
     dataset = dataset.prefetch(tf.data.AUTOTUNE)
 
@@ -88,16 +123,63 @@ def _decode_example(example_proto: tf.Tensor, type_spec: Dict[str, tf.TensorSpec
     return parsed_tensors
 
 
+def _window_trajectory(
+    traj: Dict[str, tf.Tensor], obs_history: int = 1, action_horizon: int = 1
+) -> Dict[str, tf.Tensor]:
+    # every window is gathered at once for the whole trajectory, with indices clipped to the episode
+    traj_len = tf.shape(next(iter(traj.values())))[0]
+    timesteps = tf.range(traj_len)[:, None]
+    obs_indices = timesteps + tf.range(-obs_history + 1, 1)[None]
+    action_indices = timesteps + tf.range(action_horizon)[None]
+
+    windowed = {}
+    for key, value in traj.items():
+        if key.startswith("observation/"):
+            windowed[key] = tf.gather(value, tf.maximum(obs_indices, 0))
+        elif key.startswith("action/"):
+            windowed[key] = tf.gather(value, tf.minimum(action_indices, traj_len - 1))
+        else:
+            windowed[key] = value
+
+    windowed["observation/pad_mask"] = obs_indices >= 0
+    windowed["action/pad_mask"] = action_indices < traj_len
+    return windowed
+
+
+def _decode_images(images: tf.Tensor, parallel_iterations: int = 8) -> tf.Tensor:
+    # decode JPEG strings of any shape (e.g. batches of windows), keeping the leading dimensions
+    if images.shape.rank == 0:
+        return tf.io.decode_jpeg(images)
+
+    decoded = tf.map_fn(
+        tf.io.decode_jpeg,
+        tf.reshape(images, [-1]),
+        fn_output_signature=tf.TensorSpec(shape=[None, None, None], dtype=tf.uint8),
+        parallel_iterations=parallel_iterations,
+    )
+    return tf.reshape(decoded, tf.concat([tf.shape(images), tf.shape(decoded)[1:]], axis=0))
+
+
 def _process_transition(transition: Dict[str, tf.Tensor]) -> Dict[str, tf.Tensor]:
     for key in transition:
         if "image" in key:
-            transition[key] = tf.io.decode_jpeg(transition[key])
+            transition[key] = _decode_images(transition[key])
 
             # convert to float and normalize to [-1, 1]
             transition[key] = tf.cast(transition[key], tf.float32) / 127.5 - 1.0
     return transition
 
 
+def _process_batch(batch: Dict[str, tf.Tensor], parallel_iterations: int = 8) -> Dict[str, tf.Tensor]:
+    for key in batch:
+        if "image" in key:
+            batch[key] = _decode_images(batch[key], parallel_iterations=parallel_iterations)
+
+            # convert to float and normalize to [-1, 1], vectorized over the batch
+            batch[key] = tf.cast(batch[key], tf.float32) / 127.5 - 1.0
+    return batch
+
+
 if __name__ == "__main__":
     ### EXAMPLE USAGE ###
     import tqdm
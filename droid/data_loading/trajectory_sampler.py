@@ -1,10 +1,17 @@
 import os
+import sqlite3
 
 import h5py
 import numpy as np
 
-from droid.data_processing.timestep_processing import TimestepProcesser
-from droid.trajectory_utils.misc import load_trajectory
+from droid.camera_utils.info import camera_type_to_string_dict
+from droid.camera_utils.wrappers.recorded_multi_camera_wrapper import RecordedMultiCameraWrapper
+from droid.data_loading.frame_cache import FrameCache
+from droid.data_loading.manifest import MANIFEST_FILENAME, DatasetManifest, query_manifest
+from droid.data_processing.timestep_processing import TimestepProcesser, split_processed_batch
+from droid.trajectory_utils.frame_store import FrameStoreReader, is_frame_store
+from droid.trajectory_utils.misc import load_trajectory, load_trajectory_columns, sample_trajectory_indices
+from droid.trajectory_utils.trajectory_reader import TrajectoryReader, get_columns_length
 
 
 def crawler(dirname, filter_func=None):
@@ -31,34 +38,214 @@ def crawler(dirname, filter_func=None):
     return all_folderpaths
 
 
-def generate_train_test_split(filter_func=None, remove_failures=True, train_p=0.9):
-    # Collect And Split #
-    all_folderpaths = collect_data_folderpaths(filter_func=filter_func, remove_failures=remove_failures)
+def get_trajectory_length(folderpath):
+    traj_reader = TrajectoryReader(os.path.join(folderpath, "trajectory.h5"), read_images=False)
+    length = traj_reader.length()
+    traj_reader.close()
+    return length or 0
 
-    # Split Into Train / Test #
-    num_train_traj = int(train_p * len(all_folderpaths))
-    all_ind = np.random.permutation(len(all_folderpaths))
-    training_ind, test_ind = all_ind[:num_train_traj], all_ind[num_train_traj:]
-    train_folderpaths, test_folderpaths = [], []
 
-    for i in range(len(all_folderpaths)):
-        folderpath = all_folderpaths[i]
-        if i in training_ind:
-            train_folderpaths.append(folderpath)
-        if i in test_ind:
-            test_folderpaths.append(folderpath)
+def build_timestep_index(
+    all_folderpaths,
+    recording_prefix="",
+    remove_skipped_steps=False,
+    read_cameras=True,
+    camera_kwargs={},
+    timestamp_tolerance=0,
+):
+    """
+    Indexes timesteps exactly as load_trajectory would read them. Timesteps some recorded camera has no frame for are
+    left out using timestamps and frame counts only, so building the index never decodes video.
+    """
+    traj_ids, timesteps = [], []
+
+    for traj_id, folderpath in enumerate(all_folderpaths):
+        recording_folderpath = os.path.join(folderpath, "recordings", recording_prefix)
+        read_frame_store = is_frame_store(recording_folderpath)
+        if read_frame_store:
+            traj_reader = FrameStoreReader(recording_folderpath, read_images=False)
+        else:
+            traj_reader = TrajectoryReader(os.path.join(folderpath, "trajectory.h5"), read_images=False)
+
+        curr_timesteps = sample_trajectory_indices(traj_reader, remove_skipped_steps=remove_skipped_steps)
+
+        # Drop Timesteps Without A Frame From Every Camera #
+        read_recordings = read_cameras and not read_frame_store
+        if read_recordings and os.path.exists(recording_folderpath) and len(curr_timesteps):
+            camera_columns = traj_reader.read_indices(
+                curr_timesteps, keys=["observation/camera_type", "observation/timestamp/cameras"]
+            )["observation"]
+            camera_reader = RecordedMultiCameraWrapper(recording_folderpath, camera_kwargs)
+            keep_mask = camera_reader.get_keep_mask(
+                curr_timesteps,
+                camera_type_dict={k: camera_type_to_string_dict[v[0]] for k, v in camera_columns["camera_type"].items()},
+                timestamp_dict=camera_columns["timestamp"]["cameras"],
+                timestamp_tolerance=timestamp_tolerance,
+            )
+            camera_reader.disable_cameras()
+            curr_timesteps = curr_timesteps[keep_mask]
+        traj_reader.close()
+
+        traj_ids.append(np.full(len(curr_timesteps), traj_id, dtype=np.int32))
+        timesteps.append(curr_timesteps.astype(np.int32))
+
+    if not len(traj_ids):
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+    return np.concatenate(traj_ids), np.concatenate(timesteps)
+
+
+def load_timestep_index(
+    all_folderpaths,
+    recording_prefix="",
+    remove_skipped_steps=False,
+    read_cameras=True,
+    camera_kwargs={},
+    timestamp_tolerance=0,
+    index_filepath=None,
+):
+    """
+    Returns (traj_ids, timesteps) arrays covering every loadable timestep of every trajectory (see
+    build_timestep_index). If index_filepath is given, the index is cached there and only rebuilt when the trajectory
+    list, settings or any trajectory.h5 modification time changes.
+    """
+    index_kwargs = dict(
+        recording_prefix=recording_prefix,
+        remove_skipped_steps=remove_skipped_steps,
+        read_cameras=read_cameras,
+        camera_kwargs=camera_kwargs,
+        timestamp_tolerance=timestamp_tolerance,
+    )
+    index_info = np.array(
+        [repr(sorted(index_kwargs.items()))]
+        + [f + ":" + str(os.path.getmtime(os.path.join(f, "trajectory.h5"))) for f in all_folderpaths]
+    )
+
+    if (index_filepath is not None) and os.path.isfile(index_filepath):
+        with np.load(index_filepath) as cached_index:
+            if np.array_equal(cached_index["index_info"], index_info):
+                return cached_index["traj_ids"], cached_index["timesteps"]
+
+    traj_ids, timesteps = build_timestep_index(all_folderpaths, **index_kwargs)
+
+    # Write Atomically, Since Several Ranks May Build The Index At Once #
+    if index_filepath is not None:
+        temp_filepath = "{0}.{1}.tmp".format(index_filepath, os.getpid())
+        with open(temp_filepath, "wb") as f:
+            np.savez(f, traj_ids=traj_ids, timesteps=timesteps, index_info=index_info)
+        os.replace(temp_filepath, index_filepath)
+
+    return traj_ids, timesteps
+
+
+def split_indices(num_items, train_p=0.9, seed=None, groups=None):
+    """
+    Returns a boolean train mask over num_items, with int(train_p * size) items of every group (or of everything, if
+    groups is None) chosen uniformly at random. Vectorized, so it stays instant for 100k+ trajectories.
+    """
+    rng = np.random.default_rng(seed)
+    groups = np.zeros(num_items, dtype=int) if groups is None else np.array([repr(g) for g in groups])
+    _, group_ids = np.unique(groups, return_inverse=True)
+    group_ids = group_ids.reshape(-1)
+
+    # Shuffle Within Groups, Then Rank Each Item Inside Its Group #
+    order = np.lexsort((rng.random(num_items), group_ids))
+    sorted_group_ids = group_ids[order]
+    group_rank = np.arange(num_items) - np.searchsorted(sorted_group_ids, sorted_group_ids, side="left")
+    num_train_per_group = (train_p * np.bincount(group_ids, minlength=1)).astype(int)
+
+    train_mask = np.zeros(num_items, dtype=bool)
+    train_mask[order] = group_rank < num_train_per_group[sorted_group_ids]
+    return train_mask
+
+
+def load_folder_attrs(folderpaths, manifest=None):
+    if manifest is not None:
+        return manifest.get_attrs(folderpaths)
+
+    attrs_dict = {}
+    for folderpath in folderpaths:
+        with h5py.File(os.path.join(folderpath, "trajectory.h5"), "r") as hdf5_file:
+            attrs_dict[folderpath] = dict(hdf5_file.attrs)
+    return attrs_dict
+
+
+def generate_train_test_split(
+    filter_func=None,
+    remove_failures=True,
+    train_p=0.9,
+    use_manifest=False,
+    seed=None,
+    stratify_func=None,
+    split_name=None,
+):
+    """
+    - seed: Makes the split reproducible (folderpaths are sorted first, so crawl order does not matter)
+    - stratify_func: Optional function of a trajectory's HDF5 attrs (ex: lambda attrs: attrs["scene_id"]), so every
+      lab / scene / task is split by train_p
+    - split_name: Save the split in the manifest under this name and reuse it later, only splitting new trajectories
+      (requires use_manifest)
+    """
+    # Collect #
+    all_folderpaths = sorted(
+        collect_data_folderpaths(filter_func=filter_func, remove_failures=remove_failures, use_manifest=use_manifest)
+    )
+
+    # Load Saved Split #
+    manifest, split_dict = None, {}
+    if use_manifest:
+        try:
+            manifest = DatasetManifest(os.path.join(get_data_root(), MANIFEST_FILENAME))
+            split_dict = {} if split_name is None else manifest.load_split(split_name)
+        except sqlite3.Error:
+            manifest = None
+
+    # Split Remaining Trajectories #
+    new_folderpaths = [f for f in all_folderpaths if f not in split_dict]
+    groups = None
+    if stratify_func is not None:
+        attrs_dict = load_folder_attrs(new_folderpaths, manifest=manifest)
+        groups = [stratify_func(attrs_dict[f]) for f in new_folderpaths]
+
+    train_mask = split_indices(len(new_folderpaths), train_p=train_p, seed=seed, groups=groups)
+    new_split_dict = {f: "train" if is_train else "test" for f, is_train in zip(new_folderpaths, train_mask)}
+    split_dict.update(new_split_dict)
+
+    if manifest is not None:
+        if split_name is not None:
+            manifest.save_split(split_name, new_split_dict)
+        manifest.close()
+
+    train_folderpaths = [f for f in all_folderpaths if split_dict[f] == "train"]
+    test_folderpaths = [f for f in all_folderpaths if split_dict[f] == "test"]
 
     return train_folderpaths, test_folderpaths
 
 
-def collect_data_folderpaths(filter_func=None, remove_failures=True):
-    # Prepare Data Folder #
+def get_data_root():
     dir_path = os.path.dirname(os.path.realpath(__file__))
-    data_dir = os.path.join(dir_path, "../../data")
+    return os.path.join(dir_path, "../../data")
+
+
+def collect_data_folderpaths(filter_func=None, remove_failures=True, use_manifest=False):
+    """
+    - use_manifest: Query (and incrementally update, creating it if needed) data/manifest.sqlite instead of crawling
+      the data folder, which passes filter_func a dictionary of the stored HDF5 attrs. Falls back to crawling if the
+      manifest is unavailable
+    """
+    # Prepare Data Folder #
+    data_root = get_data_root()
+    data_dir = data_root
     if remove_failures:
         data_dir = os.path.join(data_dir, "success")
 
     # Collect #
+    if use_manifest:
+        try:
+            manifest_filepath = os.path.join(data_root, MANIFEST_FILENAME)
+            return query_manifest(data_dir, filter_func=filter_func, manifest_filepath=manifest_filepath)
+        except (sqlite3.Error, OSError):
+            pass
+
     all_folderpaths = crawler(data_dir, filter_func=filter_func)
 
     # Return Paths #
@@ -74,7 +261,14 @@ class TrajectorySampler:
         timestep_filtering_kwargs={},
         image_transform_kwargs={},
         camera_kwargs={},
+        frame_cache_kwargs=None,
+        weight_by_length=False,
+        seed=None,
     ):
+        """
+        - weight_by_length: Pick trajectories in proportion to their length, so every timestep is equally likely
+        - seed: Seeds sampling when not running inside a DataLoader worker (workers use worker_info.seed)
+        """
         self._all_folderpaths = all_folderpaths
         self.recording_prefix = recording_prefix
         self.traj_loading_kwargs = traj_loading_kwargs
@@ -83,29 +277,87 @@ class TrajectorySampler:
         )
         self.camera_kwargs = camera_kwargs
 
-    def fetch_samples(self, worker_info=None):
+        # Optionally Share Decoded Frames Across Workers #
+        self.frame_cache = None if frame_cache_kwargs is None else FrameCache(**frame_cache_kwargs)
+
+        # Sharding State (Each Worker Holds Its Own Copy) #
+        self.weight_by_length = weight_by_length
+        self._seed = seed
+        self._shard_key = None
+
+    def _setup_shard(self, worker_info=None):
+        num_traj = len(self._all_folderpaths)
+
         if worker_info is None:
-            range_low, range_high = 0, len(self._all_folderpaths)
+            shard_indices, seed = np.arange(num_traj), self._seed
         else:
-            slice_size = len(self._all_folderpaths) // worker_info.num_workers
-            range_low = slice_size * worker_info.id
-            range_high = slice_size * (worker_info.id + 1)
+            # Strided Shards Cover Every Trajectory, And Differ In Size By At Most One #
+            shard_indices = np.arange(worker_info.id, num_traj, worker_info.num_workers)
+            seed = worker_info.seed
+
+            # Forked Workers Otherwise Share The Parent's NumPy State #
+            np.random.seed(worker_info.seed % 2**32)
+
+        if not len(shard_indices):
+            shard_indices = np.arange(num_traj)
+
+        shard_probs = None
+        if self.weight_by_length:
+            lengths = np.array([get_trajectory_length(self._all_folderpaths[i]) for i in shard_indices], dtype=float)
+            shard_probs = (lengths / lengths.sum()) if lengths.sum() else None
 
-        traj_ind = np.random.randint(low=range_low, high=range_high)
+        self._rng = np.random.default_rng(seed)
+        self._shard_indices, self._shard_probs = shard_indices, shard_probs
+
+    def fetch_samples(self, worker_info=None):
+        shard_key = "main" if worker_info is None else (worker_info.id, worker_info.num_workers, worker_info.seed)
+        if shard_key != self._shard_key:
+            self._setup_shard(worker_info=worker_info)
+            self._shard_key = shard_key
+
+        traj_ind = self._rng.choice(self._shard_indices, p=self._shard_probs)
+        # Process The Whole Trajectory At Once, Then Split It Into Timesteps #
+        traj_columns = self._load_trajectory(traj_ind, as_columns=True)
+        if not get_columns_length(traj_columns):
+            return []
+        processed_batch = self.timestep_processer.forward_batch(traj_columns)
+        processed_traj_samples = split_processed_batch(processed_batch)
+
+        return processed_traj_samples
+
+    def fetch_timestep(self, traj_ind, timestep):
+        # Loads A Single Timestep (Only Its Frames Are Decoded), Or None If Its Frames Are Missing #
+        traj_samples = self._load_trajectory(traj_ind, indices=[timestep])
+        if not len(traj_samples):
+            return None
+        return self.timestep_processer.forward(traj_samples[0])
+
+    def load_timestep_index(self, index_filepath=None):
+        return load_timestep_index(
+            self._all_folderpaths,
+            recording_prefix=self.recording_prefix,
+            remove_skipped_steps=self.traj_loading_kwargs.get("remove_skipped_steps", False),
+            read_cameras=self.traj_loading_kwargs.get("read_cameras", True),
+            camera_kwargs=self.camera_kwargs,
+            timestamp_tolerance=self.traj_loading_kwargs.get("timestamp_tolerance", 0),
+            index_filepath=index_filepath,
+        )
+
+    def _load_trajectory(self, traj_ind, indices=None, as_columns=False):
         folderpath = self._all_folderpaths[traj_ind]
 
+        # Recording Prefixes Written By scripts/convert/to_frame_store.py Are Read Without Decoding #
         filepath = os.path.join(folderpath, "trajectory.h5")
         recording_folderpath = os.path.join(folderpath, "recordings", self.recording_prefix)
         if not os.path.exists(recording_folderpath):
             recording_folderpath = None
 
-        traj_samples = load_trajectory(
+        load_func = load_trajectory_columns if as_columns else load_trajectory
+        return load_func(
             filepath,
             recording_folderpath=recording_folderpath,
             camera_kwargs=self.camera_kwargs,
+            frame_cache=self.frame_cache,
+            indices=indices,
             **self.traj_loading_kwargs,
         )
-
-        processed_traj_samples = [self.timestep_processer.forward(t) for t in traj_samples]
-
-        return processed_traj_samples
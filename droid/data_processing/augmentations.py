@@ -0,0 +1,287 @@
+"""
+Batched augmentations of stacked (N, H, W, C) uint8 images. Every op takes the whole batch plus per image parameters,
+builds its lookup tables / affine matrices for the batch at once, then applies them with OpenCV kernels. Images are
+assumed to be RGB(A), since ImageTransformer converts before augmenting.
+"""
+
+import os
+
+import cv2
+import numpy as np
+import torch
+from torch.utils.data import get_worker_info
+
+### Shared Helpers ###
+
+
+def apply_luts(images, luts):
+    # luts: (N, 256) Shared By All Channels, Or (N, C, 256) Per Channel #
+    num_channels = images.shape[-1]
+    luts = np.broadcast_to(luts.reshape(len(images), -1, 256), (len(images), num_channels, 256))
+    luts = np.ascontiguousarray(luts.transpose(0, 2, 1)).astype(np.uint8)
+
+    output = np.empty_like(images)
+    for i in range(len(images)):
+        output[i] = cv2.LUT(images[i], luts[i].reshape(256, 1, num_channels)).reshape(images.shape[1:])
+    return output
+
+
+def get_histograms(images):
+    # (N, C, 256) Per Channel Histograms #
+    num_channels = images.shape[-1]
+    hist = np.empty((len(images), num_channels, 256), dtype=np.float32)
+    for i in range(len(images)):
+        for c in range(num_channels):
+            hist[i, c] = cv2.calcHist([images[i]], [c], None, [256], [0, 256]).reshape(-1)
+    return hist
+
+
+def warp_affine(images, matrices, interpolation=cv2.INTER_LINEAR):
+    # matrices: (N, 2, 3) Forward Maps From Input To Output Pixels, Outside Pixels Are Filled With Zeros #
+    height, width = images.shape[1:3]
+    output = np.empty_like(images)
+    for i in range(len(images)):
+        output[i] = cv2.warpAffine(images[i], matrices[i], (width, height), flags=interpolation).reshape(
+            images.shape[1:]
+        )
+    return output
+
+
+def get_center_matrices(images, linear):
+    # Affine Matrices Applying (N, 2, 2) Linear Maps About The Image Center #
+    height, width = images.shape[1:3]
+    center = np.array([(width - 1) / 2, (height - 1) / 2])
+    offset = center - np.einsum("nij,j->ni", linear, center)
+    return np.concatenate([linear, offset[:, :, None]], axis=2)
+
+
+def random_signs(rng, num_images):
+    return rng.choice([-1.0, 1.0], size=num_images)
+
+
+### Geometric Ops ###
+
+
+def shear_x(images, severity, rng, max_shear=0.3):
+    linear = np.tile(np.eye(2), (len(images), 1, 1))
+    linear[:, 0, 1] = severity * max_shear * random_signs(rng, len(images))
+    return warp_affine(images, get_center_matrices(images, linear))
+
+
+def shear_y(images, severity, rng, max_shear=0.3):
+    linear = np.tile(np.eye(2), (len(images), 1, 1))
+    linear[:, 1, 0] = severity * max_shear * random_signs(rng, len(images))
+    return warp_affine(images, get_center_matrices(images, linear))
+
+
+def translate_x(images, severity, rng, max_translate=1 / 3):
+    matrices = np.tile(np.eye(2, 3), (len(images), 1, 1))
+    matrices[:, 0, 2] = severity * max_translate * images.shape[2] * random_signs(rng, len(images))
+    return warp_affine(images, matrices)
+
+
+def translate_y(images, severity, rng, max_translate=1 / 3):
+    matrices = np.tile(np.eye(2, 3), (len(images), 1, 1))
+    matrices[:, 1, 2] = severity * max_translate * images.shape[1] * random_signs(rng, len(images))
+    return warp_affine(images, matrices)
+
+
+def rotate(images, severity, rng, max_degrees=30):
+    angles = np.deg2rad(severity * max_degrees * random_signs(rng, len(images)))
+    cos, sin = np.cos(angles), np.sin(angles)
+    linear = np.stack([np.stack([cos, -sin], axis=1), np.stack([sin, cos], axis=1)], axis=1)
+    return warp_affine(images, get_center_matrices(images, linear))
+
+
+def random_resized_crop(images, rng, scale=(0.8, 1.0), ratio=(3 / 4, 4 / 3)):
+    # Crops A Random Region Of Each Image And Resizes It Back To (H, W) #
+    num_images, height, width = images.shape[:3]
+    area = rng.uniform(*scale, size=num_images)
+    aspect = np.exp(rng.uniform(np.log(ratio[0]), np.log(ratio[1]), size=num_images))
+    crop_w = np.clip(np.sqrt(area * aspect) * width, 1, width)
+    crop_h = np.clip(np.sqrt(area / aspect) * height, 1, height)
+    left = rng.uniform(0, 1, size=num_images) * (width - crop_w)
+    top = rng.uniform(0, 1, size=num_images) * (height - crop_h)
+
+    matrices = np.zeros((num_images, 2, 3))
+    matrices[:, 0, 0], matrices[:, 0, 2] = width / crop_w, -left * width / crop_w
+    matrices[:, 1, 1], matrices[:, 1, 2] = height / crop_h, -top * height / crop_h
+    return warp_affine(images, matrices)
+
+
+### Pixel Ops ###
+
+
+def autocontrast(images, severity, rng):
+    # Stretch Every Channel Of Every Image To The Full [0, 255] Range #
+    hist = get_histograms(images)
+    nonzero = hist > 0
+    low = np.argmax(nonzero, axis=2)[:, :, None]
+    high = 255 - np.argmax(nonzero[:, :, ::-1], axis=2)[:, :, None]
+
+    values = np.arange(256)
+    scale = 255 / np.maximum(high - low, 1)
+    luts = np.where(high > low, np.clip((values - low) * scale, 0, 255), values)
+    return apply_luts(images, np.rint(luts))
+
+
+def equalize(images, severity, rng):
+    # Histogram Equalization Of Every Channel Of Every Image #
+    hist = get_histograms(images)
+    cdf = np.cumsum(hist, axis=2)
+    cdf_min = np.take_along_axis(cdf, np.argmax(hist > 0, axis=2)[:, :, None], axis=2)
+    denom = np.maximum(cdf[:, :, -1:] - cdf_min, 1)
+    luts = np.clip(np.rint((cdf - cdf_min) * 255 / denom), 0, 255)
+    return apply_luts(images, luts)
+
+
+def posterize(images, severity, rng, max_bits_removed=4):
+    bits_removed = np.rint(severity * max_bits_removed).astype(int)
+    masks = (0xFF << bits_removed) & 0xFF
+    return apply_luts(images, np.arange(256) & masks[:, None])
+
+
+def solarize(images, severity, rng):
+    values = np.arange(256)
+    thresholds = (256 - severity * 256)[:, None]
+    return apply_luts(images, np.where(values >= thresholds, 255 - values, values))
+
+
+def get_gray_means(images):
+    channel_means = np.einsum("nck,k->nc", get_histograms(images)[:, :3], np.arange(256)) / np.prod(images.shape[1:3])
+    return channel_means @ np.array([0.299, 0.587, 0.114])
+
+
+def color_jitter(images, rng, brightness=0.2, contrast=0.2, saturation=0.2):
+    # Brightness And Contrast Are Folded Into A Single Lookup Table Per Image #
+    num_images = len(images)
+    values = np.arange(256, dtype=np.float32)
+    brightness_factors = np.ones((num_images, 1))
+    if brightness:
+        brightness_factors = rng.uniform(1 - brightness, 1 + brightness, size=(num_images, 1))
+    luts = np.clip(values * brightness_factors, 0, 255)
+
+    if contrast:
+        factors = rng.uniform(1 - contrast, 1 + contrast, size=(num_images, 1))
+        means = get_gray_means(images)[:, None] * brightness_factors
+        luts = means + factors * (luts - means)
+
+    alpha_luts = np.tile(values, (num_images, 1, 1))
+    color_luts = np.tile(np.clip(np.rint(luts), 0, 255)[:, None], (1, 3, 1))
+    jittered = apply_luts(images, np.concatenate([color_luts, alpha_luts], axis=1)[:, : images.shape[-1]])
+
+    if saturation:
+        factors = rng.uniform(1 - saturation, 1 + saturation, size=num_images)
+        for i in range(num_images):
+            rgb = jittered[i, :, :, :3]
+            gray = cv2.cvtColor(cv2.cvtColor(np.ascontiguousarray(rgb), cv2.COLOR_RGB2GRAY), cv2.COLOR_GRAY2RGB)
+            jittered[i, :, :, :3] = cv2.addWeighted(rgb, factors[i], gray, 1 - factors[i], 0)
+
+    return jittered
+
+
+augmix_ops = {
+    "autocontrast": autocontrast,
+    "equalize": equalize,
+    "posterize": posterize,
+    "solarize": solarize,
+    "rotate": rotate,
+    "shear_x": shear_x,
+    "shear_y": shear_y,
+    "translate_x": translate_x,
+    "translate_y": translate_y,
+}
+
+
+class BatchAugmenter:
+    """
+    Augments stacked (N, H, W, C) uint8 images (NumPy arrays or CPU torch tensors) together, so every camera of a
+    timestep (or a whole trajectory) shares one call instead of a PIL round trip per image.
+    - crop_scale: Random resized crop area range, or None to skip cropping
+    - color_jitter_kwargs: Brightness / contrast / saturation strengths, or None to skip jittering
+    - augmix: Mix `augmix_width` chains of 1 to `augmix_depth` random ops per image with the original, as in AugMix
+    - seed: The random generator is created in each process on first use, so forked DataLoader workers never share
+      one. Inside a worker, the seed is combined with the worker's torch seed, which differs per worker and epoch
+    """
+
+    def __init__(
+        self,
+        crop_scale=None,
+        color_jitter_kwargs=None,
+        augmix=True,
+        augmix_width=3,
+        augmix_depth=3,
+        augmix_severity=0.3,
+        augmix_alpha=1.0,
+        augmix_op_names=list(augmix_ops),
+        seed=None,
+    ):
+        self.crop_scale = crop_scale
+        self.color_jitter_kwargs = color_jitter_kwargs
+        self.augmix = augmix
+        self.augmix_width = augmix_width
+        self.augmix_depth = augmix_depth
+        self.augmix_severity = augmix_severity
+        self.augmix_alpha = augmix_alpha
+        self.augmix_ops = [augmix_ops[op_name] for op_name in augmix_op_names]
+        self.seed = seed
+        self._rng, self._rng_pid = None, None
+
+    @property
+    def rng(self):
+        if self._rng_pid != os.getpid():
+            worker_info = get_worker_info()
+            if worker_info is None:
+                entropy = self.seed
+            else:
+                entropy = worker_info.seed if self.seed is None else [worker_info.seed, self.seed]
+            self._rng, self._rng_pid = np.random.default_rng(entropy), os.getpid()
+        return self._rng
+
+    def augment_chain(self, images):
+        # Each Image Gets Its Own Chain Length, Op Sequence And Severities #
+        num_images = len(images)
+        chain_depth = self.rng.integers(1, self.augmix_depth + 1, size=num_images)
+        images = images.copy()
+
+        for step in range(self.augmix_depth):
+            op_ids = np.where(chain_depth > step, self.rng.integers(len(self.augmix_ops), size=num_images), -1)
+            severity = self.rng.uniform(0.1, 1, size=num_images) * self.augmix_severity
+            for op_id in np.unique(op_ids[op_ids >= 0]):
+                mask = op_ids == op_id
+                images[mask] = self.augmix_ops[op_id](images[mask], severity[mask], self.rng)
+
+        return images
+
+    def apply_augmix(self, images):
+        num_images = len(images)
+        weights = self.rng.dirichlet([self.augmix_alpha] * self.augmix_width, size=num_images)
+        original_weight = self.rng.beta(self.augmix_alpha, self.augmix_alpha, size=(num_images, 1))
+        coeffs = np.concatenate([original_weight, (1 - original_weight) * weights], axis=1).astype(np.float32)
+        chains = [self.augment_chain(images) for _ in range(self.augmix_width)]
+
+        # Mix Image By Image, So The Float Accumulator Stays In Cache #
+        mixed = np.empty_like(images)
+        for i in range(num_images):
+            accumulator = images[i] * coeffs[i, 0]
+            for j, chain in enumerate(chains):
+                accumulator += chain[i] * coeffs[i, j + 1]
+            mixed[i] = np.clip(np.rint(accumulator), 0, 255)
+
+        return mixed
+
+    def forward(self, images):
+        is_tensor = isinstance(images, torch.Tensor)
+        if is_tensor:
+            images = images.numpy()
+        if not len(images):
+            return torch.from_numpy(images) if is_tensor else images
+
+        if self.crop_scale is not None:
+            images = random_resized_crop(images, self.rng, scale=self.crop_scale)
+        if self.color_jitter_kwargs is not None:
+            images = color_jitter(images, self.rng, **self.color_jitter_kwargs)
+        if self.augmix:
+            images = self.apply_augmix(images)
+
+        return torch.from_numpy(images) if is_tensor else images
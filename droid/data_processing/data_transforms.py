@@ -1,52 +1,155 @@
+from collections import defaultdict
+
 import cv2
+import numpy as np
+import torch
 from torchvision import transforms as T
 
+from droid.data_processing.augmentations import BatchAugmenter
+
 
 class ImageTransformer:
     def __init__(
-        self, remove_alpha=False, bgr_to_rgb=False, augment=False, to_tensor=False, image_path="observation/camera/image"
+        self,
+        remove_alpha=False,
+        bgr_to_rgb=False,
+        augment=False,
+        to_tensor=False,
+        image_path="observation/camera/image",
+        augment_mode="pil",
+        augment_kwargs={},
+        uint8_tensor=False,
     ):
+        """
+        - augment_mode: "pil" runs torchvision AugMix on every image separately, "batch" augments all images of a
+          timestep (or trajectory) together with a vectorized BatchAugmenter(**augment_kwargs)
+        - uint8_tensor: With to_tensor, keep uint8 values in [0, 255] instead of floats in [0, 1], so the float
+          conversion can be deferred to the model
+        """
+        assert augment_mode in ["pil", "batch"]
         self.image_path = image_path.split("/")
         self.apply_transforms = any([remove_alpha, bgr_to_rgb, augment, to_tensor])
 
-        # Build Composed Transform #
-        transforms = []
+        self.remove_alpha = remove_alpha
+        self.bgr_to_rgb = bgr_to_rgb
+        self.to_tensor = to_tensor
+        self.uint8_tensor = uint8_tensor
+
+        # Augmentation Runs Between Channel Selection And Tensor Conversion #
+        self.pil_transforms = None
+        if augment and augment_mode == "pil":
+            self.pil_transforms = T.Compose([T.ToPILImage(), T.AugMix()])
+        self.batch_augmenter = BatchAugmenter(**augment_kwargs) if (augment and augment_mode == "batch") else None
+
+        # Without Augmentation, Channel Selection And Tensor Conversion Are Fused Into One Copy #
+        self.fuse_tensor_conversion = to_tensor and not augment
+
+    def select_channels(self, data):
+        # Alpha Stripping And BGR -> RGB As A (Strided) View, For Tensor Conversion To Copy In One Pass #
+        if self.remove_alpha and self.bgr_to_rgb:
+            return data[..., 2::-1]
+        if self.remove_alpha:
+            return data[..., :3]
+        if self.bgr_to_rgb and data.shape[-1] == 4:
+            return data[..., [2, 1, 0, 3]]
+        if self.bgr_to_rgb:
+            return data[..., ::-1]
+        return data
+
+    def convert_channels(self, data):
+        # For HWC Outputs, OpenCV Strips Alpha And Swaps Channels In One (Much Faster) Pass #
+        if not self.bgr_to_rgb:
+            return self.select_channels(data)
+
+        if data.shape[-1] == 4:
+            code = cv2.COLOR_BGRA2RGB if self.remove_alpha else cv2.COLOR_BGRA2RGBA
+        else:
+            code = cv2.COLOR_BGR2RGB
+
+        data = np.ascontiguousarray(data)
+        converted = cv2.cvtColor(data.reshape(-1, *data.shape[-2:]), code)
+        return converted.reshape(*data.shape[:-1], converted.shape[-1])
+
+    def convert_to_tensor(self, data, batched=False):
+        # HWC -> CHW (And uint8 -> [0, 1] float, Like T.ToTensor) In A Single Pass #
+        data = np.asarray(data)
+        if data.ndim == (3 if batched else 2):
+            data = data[..., None]
+        data = data.transpose((0, 3, 1, 2) if batched else (2, 0, 1))
+
+        if data.dtype == np.uint8 and not self.uint8_tensor:
+            return torch.from_numpy(np.divide(data, np.float32(255), dtype=np.float32, order="C"))
+        return torch.from_numpy(np.ascontiguousarray(data))
+
+    def augment_images(self, image_list, batched=False):
+        # Augment Every Image Together, With One Stack Per Image Shape #
+        batches = image_list if batched else [data[None] for data in image_list]
+        shape_dict = defaultdict(list)
+        for i, batch in enumerate(batches):
+            shape_dict[batch.shape[1:]].append(i)
 
-        if remove_alpha:
-            new_transform = T.Lambda(lambda data: data[:, :, :3])
-            transforms.append(new_transform)
+        augmented_batches = list(batches)
+        for batch_ids in shape_dict.values():
+            stacked = self.batch_augmenter.forward(np.concatenate([batches[i] for i in batch_ids]))
+            split_points = np.cumsum([len(batches[i]) for i in batch_ids])[:-1]
+            for i, augmented in zip(batch_ids, np.split(stacked, split_points)):
+                augmented_batches[i] = augmented
 
-        if bgr_to_rgb:
+        return augmented_batches if batched else [batch[0] for batch in augmented_batches]
 
-            def helper(data):
-                if data.shape[-1] == 4:
-                    return cv2.cvtColor(data, cv2.COLOR_BGRA2RGBA)
-                return cv2.cvtColor(data, cv2.COLOR_BGR2RGB)
+    def transform_images(self, obs, batched=False):
+        def convert_images(data):
+            if self.fuse_tensor_conversion:
+                return self.convert_to_tensor(self.select_channels(data), batched=batched)
+            return self.convert_channels(data)
 
-            new_transform = T.Lambda(lambda data: helper(data))
-            transforms.append(new_transform)
+        def apply_pil_transforms(data):
+            if not batched:
+                return self.pil_transforms(np.ascontiguousarray(data))
+            frames = [self.pil_transforms(np.ascontiguousarray(frame)) for frame in data]
+            return np.stack(frames) if len(frames) else data
 
-        if augment:
-            transforms.append(T.ToPILImage())
-            transforms.append(T.AugMix())
+        # Channel Selection (Plus Tensor Conversion, When Nothing Runs In Between) #
+        image_ids = [(cam_type, i) for cam_type in obs for i in range(len(obs[cam_type]))]
+        image_list = [convert_images(obs[cam_type][i]) for cam_type, i in image_ids]
 
-        if to_tensor:
-            transforms.append(T.ToTensor())
+        # Augmentation #
+        if self.pil_transforms is not None:
+            image_list = [apply_pil_transforms(data) for data in image_list]
+        if self.batch_augmenter is not None:
+            image_list = self.augment_images(image_list, batched=batched)
 
-        self.composed_transforms = T.Compose(transforms)
+        # Remaining Tensor Conversion #
+        if self.to_tensor and not self.fuse_tensor_conversion:
+            image_list = [self.convert_to_tensor(data, batched=batched) for data in image_list]
+
+        for (cam_type, i), data in zip(image_ids, image_list):
+            obs[cam_type][i] = data
 
     def forward(self, timestep):
         # Skip If Unnecesary #
         if not self.apply_transforms:
             return timestep
 
-        # Isolate Image Data #
+        # Isolate Image Data (Timesteps Without Images Have Nothing To Transform) #
         obs = timestep
         for key in self.image_path:
-            obs = obs[key]
+            obs = obs.get(key, {})
+
+        # Apply Transforms #
+        self.transform_images(obs)
+
+    def forward_batch(self, batch):
+        # Same As forward, But Each Image Is A (T, H, W, C) Array Of Frames #
+        if not self.apply_transforms:
+            return batch
+
+        # Isolate Image Data #
+        obs = batch
+        for key in self.image_path:
+            obs = obs.get(key, {})
 
         # Apply Transforms #
-        for cam_type in obs:
-            for i in range(len(obs[cam_type])):
-                data = self.composed_transforms(obs[cam_type][i])
-                obs[cam_type][i] = data
+        self.transform_images(obs, batched=True)
+
+        return batch
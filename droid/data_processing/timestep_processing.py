@@ -1,11 +1,11 @@
 from collections import defaultdict
-from copy import deepcopy
 from itertools import chain
 
 import numpy as np
 
 from droid.camera_utils.info import camera_type_to_string_dict
 from droid.data_processing.data_transforms import ImageTransformer
+from droid.trajectory_utils.trajectory_reader import get_columns_length
 
 
 class TimestepProcesser:
@@ -34,79 +34,45 @@ class TimestepProcesser:
 
         self.image_transformer = ImageTransformer(**image_transform_kwargs)
 
+        # Key Layouts, Computed Once Per Trajectory Schema #
+        self._layout_cache = {}
+
     def forward(self, timestep):
-        # Make Deep Copy #
-        timestep = deepcopy(timestep)
+        # The Input Is Never Modified Or Copied, Only Transformed Images Are New Arrays #
+        observation = timestep["observation"]
 
         # Get Relevant Camera Info #
-        camera_type_dict = {k: camera_type_to_string_dict[v] for k, v in timestep["observation"]["camera_type"].items()}
-        sorted_camera_ids = sorted(camera_type_dict.keys())
+        camera_type_dict = {k: camera_type_to_string_dict[v] for k, v in observation["camera_type"].items()}
+        layout = self.get_layout(observation, camera_type_dict)
 
         ### Get Robot State Info ###
-        sorted_state_keys = sorted(self.robot_state_keys)
-        full_robot_state = timestep["observation"]["robot_state"]
-        robot_state = [np.array(full_robot_state[key]).flatten() for key in sorted_state_keys]
-        if len(robot_state):
-            robot_state = np.concatenate(robot_state)
+        full_robot_state = observation["robot_state"]
+        robot_state = [np.asarray(full_robot_state[key]).reshape(-1) for key in sorted(self.robot_state_keys)]
 
         ### Get Extrinsics ###
-        calibration_dict = timestep["observation"]["camera_extrinsics"]
-        sorted_calibrated_ids = sorted(calibration_dict.keys())
-        extrinsics_dict = defaultdict(list)
-
-        for serial_number in sorted_camera_ids:
-            cam_type = camera_type_dict[serial_number]
-            if cam_type not in self.camera_extrinsics:
-                continue
-
-            for full_cam_id in sorted_calibrated_ids:
-                if serial_number in full_cam_id:
-                    cam2base = calibration_dict[full_cam_id]
-                    extrinsics_dict[cam_type].append(cam2base)
-
-        sorted_extrinsics_keys = sorted(extrinsics_dict.keys())
-        extrinsics_state = list(chain(*[extrinsics_dict[cam_type] for cam_type in sorted_extrinsics_keys]))
-        if len(extrinsics_state):
-            extrinsics_state = np.concatenate(extrinsics_state)
+        extrinsics_dict = {
+            cam_type: [observation["camera_extrinsics"][k] for k in keys]
+            for cam_type, keys in layout["extrinsics"].items()
+        }
+        extrinsics_state = [np.asarray(data).reshape(-1) for data in chain(*extrinsics_dict.values())]
 
         ### Get Intrinsics ###
-        cam_intrinsics_obs = timestep["observation"]["camera_intrinsics"]
-        sorted_calibrated_ids = sorted(calibration_dict.keys())
-        intrinsics_dict = defaultdict(list)
-
-        for serial_number in sorted_camera_ids:
-            cam_type = camera_type_dict[serial_number]
-            if cam_type not in self.camera_extrinsics:
-                continue
-
-            full_cam_ids = sorted(cam_intrinsics_obs.keys())
-            for full_cam_id in full_cam_ids:
-                if serial_number in full_cam_id:
-                    intr = cam_intrinsics_obs[full_cam_id]
-                    intrinsics_dict[cam_type].append(intr)
-
-        sorted_intrinsics_keys = sorted(intrinsics_dict.keys())
-        intrinsics_state = list([np.array(intrinsics_dict[cam_type]).flatten() for cam_type in sorted_intrinsics_keys])
-        if len(intrinsics_state):
-            intrinsics_state = np.concatenate(intrinsics_state)
+        intrinsics_dict = {
+            cam_type: [observation["camera_intrinsics"][k] for k in keys]
+            for cam_type, keys in layout["intrinsics"].items()
+        }
+        intrinsics_state = [np.asarray(data).reshape(-1) for data in chain(*intrinsics_dict.values())]
 
         ### Get High Dimensional State Info ###
-        high_dim_state_dict = defaultdict(lambda: defaultdict(list))
-
-        for obs_type in ["image", "depth", "pointcloud"]:
-            obs_type_dict = timestep["observation"].get(obs_type, {})
-            sorted_obs_ids = sorted(obs_type_dict.keys())
-
-            for serial_number in sorted_camera_ids:
-                cam_type = camera_type_dict[serial_number]
-
-                for full_obs_id in sorted_obs_ids:
-                    if serial_number in full_obs_id:
-                        data = obs_type_dict[full_obs_id]
-                        high_dim_state_dict[obs_type][cam_type].append(data)
+        high_dim_state_dict = {
+            obs_type: {cam_type: [observation[obs_type][k] for k in keys] for cam_type, keys in cam_dict.items()}
+            for obs_type, cam_dict in layout["high_dim"].items()
+        }
 
         ### Finish Observation Portion ###
-        low_level_state = np.concatenate([robot_state, extrinsics_state, intrinsics_state], dtype=self.state_dtype)
+        low_level_state = np.concatenate(
+            [*robot_state, *extrinsics_state, *intrinsics_state, np.zeros(0)], dtype=self.state_dtype
+        )
         processed_timestep = {"observation": {"state": low_level_state, "camera": high_dim_state_dict}}
         self.image_transformer.forward(processed_timestep)
 
@@ -122,3 +88,121 @@ class TimestepProcesser:
         processed_timestep["intrinsics_dict"] = intrinsics_dict
 
         return processed_timestep
+
+    def get_layout(self, observation, camera_type_dict):
+        """
+        Returns the key ordering used by forward() and forward_batch() for one schema (cameras, calibration and image
+        keys):
+        - extrinsics / intrinsics: {cam_type: [calibration keys]}, in state order
+        - high_dim: {obs_type: {cam_type: [observation keys]}}
+        """
+        schema = (
+            tuple(sorted(camera_type_dict.items())),
+            tuple(sorted(observation["camera_extrinsics"].keys())),
+            tuple(sorted(observation["camera_intrinsics"].keys())),
+            tuple(tuple(sorted(observation.get(obs_type, {}).keys())) for obs_type in ["image", "depth", "pointcloud"]),
+        )
+        if schema in self._layout_cache:
+            return self._layout_cache[schema]
+
+        sorted_camera_ids = sorted(camera_type_dict.keys())
+        calibrated_ids, intrinsics_ids = schema[1], schema[2]
+        extrinsics_layout, intrinsics_layout = defaultdict(list), defaultdict(list)
+        high_dim_layout = defaultdict(lambda: defaultdict(list))
+
+        for serial_number in sorted_camera_ids:
+            cam_type = camera_type_dict[serial_number]
+            for obs_type, sorted_obs_ids in zip(["image", "depth", "pointcloud"], schema[3]):
+                for full_obs_id in sorted_obs_ids:
+                    if serial_number in full_obs_id:
+                        high_dim_layout[obs_type][cam_type].append(full_obs_id)
+
+            if cam_type not in self.camera_extrinsics:
+                continue
+            for full_cam_id in calibrated_ids:
+                if serial_number in full_cam_id:
+                    extrinsics_layout[cam_type].append(full_cam_id)
+            for full_cam_id in intrinsics_ids:
+                if serial_number in full_cam_id:
+                    intrinsics_layout[cam_type].append(full_cam_id)
+
+        layout = {
+            "extrinsics": {k: extrinsics_layout[k] for k in sorted(extrinsics_layout)},
+            "intrinsics": {k: intrinsics_layout[k] for k in sorted(intrinsics_layout)},
+            "high_dim": {obs_type: dict(cam_dict) for obs_type, cam_dict in high_dim_layout.items()},
+        }
+        self._layout_cache[schema] = layout
+        return layout
+
+    def forward_batch(self, columns):
+        """
+        Batched forward() over a whole trajectory in columnar form (nested dictionary of (T, ...) arrays, such as
+        load_trajectory_columns returns). Produces the same fields as forward(), stacked along a leading time axis:
+        - observation/state: (T, D) and action: (T, A)
+        - observation/camera/<obs type>/<cam type>: List of (T, ...) arrays, one per camera image
+        """
+        observation = columns["observation"]
+        camera_type_dict = {k: camera_type_to_string_dict[v[0]] for k, v in observation["camera_type"].items()}
+        layout = self.get_layout(observation, camera_type_dict)
+        length = get_columns_length(columns) or 0
+
+        def stack_columns(arrays):
+            arrays = [np.asarray(data).reshape(length, -1) for data in arrays]
+            return np.concatenate(arrays, axis=1) if len(arrays) else np.zeros((length, 0))
+
+        ### Get Low Dimensional State ###
+        full_robot_state = observation["robot_state"]
+        robot_state = stack_columns([full_robot_state[key] for key in sorted(self.robot_state_keys)])
+
+        extrinsics_dict = {
+            cam_type: [observation["camera_extrinsics"][k] for k in keys]
+            for cam_type, keys in layout["extrinsics"].items()
+        }
+        extrinsics_state = stack_columns(list(chain(*extrinsics_dict.values())))
+
+        intrinsics_dict = {
+            cam_type: [observation["camera_intrinsics"][k] for k in keys]
+            for cam_type, keys in layout["intrinsics"].items()
+        }
+        intrinsics_state = stack_columns(list(chain(*intrinsics_dict.values())))
+
+        ### Get High Dimensional State Info ###
+        high_dim_state_dict = {
+            obs_type: {cam_type: [observation[obs_type][k] for k in keys] for cam_type, keys in cam_dict.items()}
+            for obs_type, cam_dict in layout["high_dim"].items()
+        }
+
+        ### Finish Observation Portion ###
+        low_level_state = np.concatenate(
+            [robot_state, extrinsics_state, intrinsics_state], axis=1, dtype=self.state_dtype
+        )
+        processed_batch = {"observation": {"state": low_level_state, "camera": high_dim_state_dict}}
+        self.image_transformer.forward_batch(processed_batch)
+
+        ### Add Proper Action ###
+        if not self.ignore_action:
+            arm_action = np.asarray(columns["action"][self.action_space])
+            gripper_action = np.asarray(columns["action"][self.gripper_key])
+            action = np.concatenate([arm_action, gripper_action.reshape(-1, 1)], axis=1, dtype=self.action_dtype)
+            processed_batch["action"] = action
+
+        # return raw information + meta data
+        processed_batch["extrinsics_dict"] = extrinsics_dict
+        processed_batch["intrinsics_dict"] = intrinsics_dict
+
+        return processed_batch
+
+
+def split_processed_batch(processed_batch, length=None):
+    # Turns forward_batch Output Back Into forward Style Timesteps (Array Views, No Copies) #
+    if length is None:
+        length = len(processed_batch["observation"]["state"])
+
+    def index_batch(data, i):
+        if isinstance(data, dict):
+            return {key: index_batch(curr_data, i) for key, curr_data in data.items()}
+        if isinstance(data, list):
+            return [curr_data[i] for curr_data in data]
+        return data[i]
+
+    return [index_batch(processed_batch, i) for i in range(length)]
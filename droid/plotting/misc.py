@@ -7,6 +7,7 @@ import numpy as np
 from dateutil.relativedelta import relativedelta
 from scipy import stats
 
+from droid.data_loading.manifest import query_manifest
 from droid.plotting.misc import *
 from droid.plotting.text import *
 
@@ -14,8 +15,23 @@ from droid.plotting.text import *
 num_demos = 0
 
 
-def data_crawler(dirname, func_list=None, ignore_failure=True):
+def data_crawler(dirname, func_list=None, ignore_failure=True, use_manifest=False):
     global num_demos
+
+    # Find Trajectories Through The Manifest Instead Of Recursing #
+    if use_manifest:
+        for folderpath in query_manifest(dirname):
+            if ignore_failure and "failure" in folderpath:
+                continue
+            num_demos += 1
+            print("Num Demos:", num_demos)
+
+            traj_filepath = os.path.join(folderpath, "trajectory.h5")
+            for func in func_list:
+                hdf5_file = h5py.File(traj_filepath, "r")
+                func(traj_filepath, hdf5_file=hdf5_file)
+        return
+
     subfolders = [f.path for f in os.scandir(dirname) if f.is_dir()]
     traj_files = [f.path for f in os.scandir(dirname) if (f.is_file() and "trajectory.h5" in f.path)]
     h5_file_exists = len(traj_files) == 1
@@ -0,0 +1,174 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from droid.camera_utils.info import camera_type_to_string_dict
+from droid.camera_utils.wrappers.recorded_multi_camera_wrapper import RecordedMultiCameraWrapper
+from droid.trajectory_utils.trajectory_reader import (
+    TrajectoryReader,
+    get_columns_length,
+    index_nested_dict,
+    is_same_branch,
+)
+
+STORE_INFO_FILENAME = "frame_store.json"
+
+
+def is_frame_store(folderpath):
+    # The Info File Is Written Last, So Its Presence Marks A Complete Store #
+    return (folderpath is not None) and os.path.isfile(os.path.join(folderpath, STORE_INFO_FILENAME))
+
+
+def write_column_store(columns, folderpath):
+    os.makedirs(folderpath, exist_ok=True)
+    for key, curr_data in columns.items():
+        if isinstance(curr_data, dict):
+            write_column_store(curr_data, os.path.join(folderpath, key))
+        else:
+            np.save(os.path.join(folderpath, key + ".npy"), curr_data)
+
+
+def load_column_store(folderpath, mmap_mode="r"):
+    columns = {}
+
+    for f in sorted(os.listdir(folderpath)):
+        curr_path = os.path.join(folderpath, f)
+        if os.path.isdir(curr_path):
+            columns[f] = load_column_store(curr_path, mmap_mode=mmap_mode)
+        elif f.endswith(".npy"):
+            columns[f[:-4]] = np.load(curr_path, mmap_mode=mmap_mode)
+
+    return columns
+
+
+def select_columns(columns, keys=None, keys_to_ignore=[], parent_keys=()):
+    requested_keys = None if keys is None else [tuple(path.strip("/").split("/")) for path in keys]
+    selected_columns = {}
+
+    for key, curr_data in columns.items():
+        curr_keys = (*parent_keys, key)
+        if key in keys_to_ignore:
+            continue
+        if requested_keys is not None and not any(is_same_branch(curr_keys, req_keys) for req_keys in requested_keys):
+            continue
+
+        if isinstance(curr_data, dict):
+            selected_columns[key] = select_columns(curr_data, keys, keys_to_ignore, parent_keys=curr_keys)
+        else:
+            selected_columns[key] = curr_data
+
+    return selected_columns
+
+
+def convert_trajectory(
+    filepath, recording_folderpath, store_folderpath, camera_kwargs={}, chunk_length=64, timestamp_tolerance=0
+):
+    """
+    Decodes (and resizes) every recorded frame of a trajectory once, and writes a memory-mappable frame store:
+    - <image key>.npy: (T, H, W, C) frames aligned with the T timesteps of trajectory.h5
+    - valid.npy: Whether every camera had a frame for each timestep
+    - lowdim/: One .npy column per HDF5 dataset, mirroring the HDF5 layout
+    The store is built in a temporary folder and renamed into place, so interrupted conversions are simply redone.
+    Returns False if the store already existed.
+    """
+    if is_frame_store(store_folderpath):
+        return False
+
+    temp_folderpath = store_folderpath.rstrip("/") + ".tmp"
+    shutil.rmtree(temp_folderpath, ignore_errors=True)
+    os.makedirs(temp_folderpath)
+
+    # Copy Low Dimensional Data #
+    traj_reader = TrajectoryReader(filepath, read_images=False)
+    columns = traj_reader.read_range()
+    traj_reader.close()
+    write_column_store(columns, os.path.join(temp_folderpath, "lowdim"))
+
+    # Decode Frames In Chunks, Writing Them Straight Into Memory Maps #
+    length = get_columns_length(columns)
+    camera_reader = RecordedMultiCameraWrapper(recording_folderpath, camera_kwargs)
+    camera_type_dict = {
+        k: camera_type_to_string_dict[v[0]] for k, v in columns["observation"]["camera_type"].items() if len(v)
+    }
+    timestamp_dict = columns["observation"]["timestamp"]["cameras"]
+    valid = np.zeros(length, dtype=bool)
+    frame_stores = {}
+
+    for start in range(0, length, chunk_length):
+        indices = np.arange(start, min(start + chunk_length, length))
+        chunk_timestamps = {key: timestamps[indices] for key, timestamps in timestamp_dict.items()}
+        camera_obs, keep_mask = camera_reader.read_frames(
+            indices,
+            camera_type_dict=camera_type_dict,
+            timestamp_dict=chunk_timestamps,
+            timestamp_tolerance=timestamp_tolerance,
+        )
+
+        for image_key, frames in camera_obs.get("image", {}).items():
+            if image_key not in frame_stores:
+                frame_store_path = os.path.join(temp_folderpath, image_key + ".npy")
+                frame_stores[image_key] = np.lib.format.open_memmap(
+                    frame_store_path, mode="w+", dtype=frames.dtype, shape=(length, *frames.shape[1:])
+                )
+            frame_stores[image_key][indices[keep_mask]] = frames
+        valid[indices] = keep_mask
+
+    camera_reader.disable_cameras()
+    for frames in frame_stores.values():
+        frames.flush()
+    np.save(os.path.join(temp_folderpath, "valid.npy"), valid)
+
+    # Publish Store #
+    store_info = {"length": length, "image_keys": sorted(frame_stores), "camera_kwargs": camera_kwargs}
+    with open(os.path.join(temp_folderpath, STORE_INFO_FILENAME), "w") as jsonFile:
+        json.dump(store_info, jsonFile)
+
+    shutil.rmtree(store_folderpath, ignore_errors=True)
+    os.rename(temp_folderpath, store_folderpath)
+    return True
+
+
+class FrameStoreReader:
+    """
+    Reads a frame store (see convert_trajectory) with the same interface as TrajectoryReader, without any decoding.
+    Timesteps some camera was missing a frame for are skipped, so index i refers to the i'th valid timestep.
+    """
+
+    def __init__(self, folderpath, read_images=True):
+        with open(os.path.join(folderpath, STORE_INFO_FILENAME), "r") as jsonFile:
+            self.store_info = json.load(jsonFile)
+
+        self._columns = load_column_store(os.path.join(folderpath, "lowdim"))
+        self._valid_indices = np.flatnonzero(np.load(os.path.join(folderpath, "valid.npy")))
+        self._read_images = read_images and len(self.store_info["image_keys"]) > 0
+        self._frame_stores = {
+            image_key: np.load(os.path.join(folderpath, image_key + ".npy"), mmap_mode="r")
+            for image_key in self.store_info["image_keys"]
+        }
+
+    def length(self):
+        return len(self._valid_indices)
+
+    def has_images(self):
+        return self._read_images
+
+    def read_range(self, start=0, stop=None, keys=None, keys_to_ignore=[]):
+        if stop is None:
+            stop = self.length()
+        assert 0 <= start <= stop <= self.length()
+        return self.read_indices(np.arange(start, stop), keys=keys, keys_to_ignore=keys_to_ignore)
+
+    def read_indices(self, indices, keys=None, keys_to_ignore=[]):
+        store_indices = self._valid_indices[np.asarray(indices, dtype=int)]
+        columns = select_columns(self._columns, keys=keys, keys_to_ignore=keys_to_ignore)
+        return index_nested_dict(columns, store_indices)
+
+    def read_image_indices(self, indices):
+        store_indices = self._valid_indices[np.asarray(indices, dtype=int)]
+        frame_dict = {image_key: frames[store_indices] for image_key, frames in self._frame_stores.items()}
+        return frame_dict, np.ones(len(store_indices), dtype=bool)
+
+    def close(self):
+        self._columns, self._frame_stores = {}, {}
@@ -12,7 +12,13 @@ from droid.camera_utils.wrappers.recorded_multi_camera_wrapper import RecordedMu
 from droid.misc.parameters import *
 from droid.misc.time import time_ms
 from droid.misc.transformations import change_pose_frame
-from droid.trajectory_utils.trajectory_reader import TrajectoryReader
+from droid.trajectory_utils.frame_store import FrameStoreReader, is_frame_store
+from droid.trajectory_utils.trajectory_reader import (
+    TrajectoryReader,
+    get_columns_length,
+    index_nested_dict,
+    split_columns_to_timesteps,
+)
 from droid.trajectory_utils.trajectory_writer import TrajectoryWriter
 
 
@@ -29,6 +35,8 @@ def collect_trajectory(
     recording_folderpath=False,
     randomize_reset=False,
     reset_robot=True,
+    traj_writer_kwargs={},
+    log_writer_stats=False,
 ):
     """
     Collects a robot trajectory.
@@ -36,6 +44,8 @@ def collect_trajectory(
     - If a horizon is given, we will step the environment accordingly
     - Otherwise, we will end the trajectory when the controller tells us to
     - If you need a pointer to the current observation, pass a dictionary in for obs_pointer
+    - Extra TrajectoryWriter arguments (ex: buffered=True) can be passed in through traj_writer_kwargs
+    - If log_writer_stats is True, writer queue statistics are saved next to the control timestamps
     """
 
     # Check Parameters #
@@ -55,7 +65,7 @@ def collect_trajectory(
 
     # Prepare Data Writers If Necesary #
     if save_filepath:
-        traj_writer = TrajectoryWriter(save_filepath, metadata=metadata, save_images=save_images)
+        traj_writer = TrajectoryWriter(save_filepath, metadata=metadata, save_images=save_images, **traj_writer_kwargs)
     if recording_folderpath:
         env.camera_reader.start_recording(recording_folderpath)
 
@@ -110,6 +120,8 @@ def collect_trajectory(
         # Save Data #
         control_timestamps["step_end"] = time_ms()
         obs["timestamp"]["control"] = control_timestamps
+        if save_filepath and log_writer_stats:
+            obs["timestamp"]["writer"] = traj_writer.get_writer_stats()
         timestep = {"observation": obs, "action": action_info}
         if save_filepath:
             traj_writer.write_timestep(timestep)
@@ -315,6 +327,22 @@ def replay_trajectory(
             env.step(action)
 
 
+def sample_trajectory_indices(traj_reader, remove_skipped_steps=False, num_samples_per_traj=None):
+    # Filter Skipped Steps With A Single Bulk Read #
+    candidate_indices = np.arange(traj_reader.length())
+    if remove_skipped_steps:
+        controller_info = traj_reader.read_range(keys=["observation/controller_info"])
+        movement_enabled = controller_info.get("observation", {}).get("controller_info", {}).get("movement_enabled")
+        if movement_enabled is not None:
+            candidate_indices = candidate_indices[movement_enabled.astype(bool)]
+
+    # Sample From Remaining Steps #
+    if num_samples_per_traj and (len(candidate_indices) > num_samples_per_traj):
+        candidate_indices = np.sort(np.random.choice(candidate_indices, size=num_samples_per_traj, replace=False))
+
+    return candidate_indices
+
+
 def load_trajectory(
     filepath=None,
     read_cameras=True,
@@ -323,64 +351,101 @@ def load_trajectory(
     remove_skipped_steps=False,
     num_samples_per_traj=None,
     num_samples_per_traj_coeff=1.5,
+    timestamp_tolerance=0,
+    frame_cache=None,
+    indices=None,
 ):
+    """
+    Loads a trajectory as an array of timestep dictionaries.
+    - indices: Optional timesteps to load, in which case remove_skipped_steps / num_samples_per_traj are ignored
+    - The final set of timesteps is chosen before any data is read, so only kept frames get decoded
+    - num_samples_per_traj_coeff is no longer needed, since skipped steps are filtered out before sampling
+    - timestamp_tolerance: Recorded frames within this many ms of a timestep's camera timestamp are used for it, and
+      timesteps without a matching frame are dropped individually
+    - frame_cache: Optional FrameCache, so recordings are decoded once and shared between processes afterwards
+    - If recording_folderpath is a frame store (see scripts/convert/to_frame_store.py), all data comes from its memory
+      maps without decoding, and camera_kwargs / timestamp_tolerance are the ones it was converted with
+    """
+    columns = load_trajectory_columns(
+        filepath=filepath,
+        read_cameras=read_cameras,
+        recording_folderpath=recording_folderpath,
+        camera_kwargs=camera_kwargs,
+        remove_skipped_steps=remove_skipped_steps,
+        num_samples_per_traj=num_samples_per_traj,
+        timestamp_tolerance=timestamp_tolerance,
+        frame_cache=frame_cache,
+        indices=indices,
+    )
+    timestep_list = split_columns_to_timesteps(columns, length=get_columns_length(columns) or 0)
+    return np.array(timestep_list)
+
+
+def load_trajectory_columns(
+    filepath=None,
+    read_cameras=True,
+    recording_folderpath=None,
+    camera_kwargs={},
+    remove_skipped_steps=False,
+    num_samples_per_traj=None,
+    num_samples_per_traj_coeff=1.5,
+    timestamp_tolerance=0,
+    frame_cache=None,
+    indices=None,
+):
+    """
+    Same as load_trajectory, but returns the trajectory as one nested dictionary of (T, ...) arrays (with frames under
+    observation/image), for batched processing such as TimestepProcesser.forward_batch.
+    """
+    read_frame_store = is_frame_store(recording_folderpath)
     read_hdf5_images = read_cameras and (recording_folderpath is None)
-    read_recording_folderpath = read_cameras and (recording_folderpath is not None)
+    read_recording_folderpath = read_cameras and (recording_folderpath is not None) and not read_frame_store
 
-    traj_reader = TrajectoryReader(filepath, read_images=read_hdf5_images)
+    if read_frame_store:
+        traj_reader = FrameStoreReader(recording_folderpath, read_images=read_cameras)
+    else:
+        traj_reader = TrajectoryReader(filepath, read_images=read_hdf5_images)
     if read_recording_folderpath:
-        camera_reader = RecordedMultiCameraWrapper(recording_folderpath, camera_kwargs)
-
-    horizon = traj_reader.length()
-    timestep_list = []
+        camera_reader = RecordedMultiCameraWrapper(recording_folderpath, camera_kwargs, frame_cache=frame_cache)
 
     # Choose Timesteps To Save #
-    if num_samples_per_traj:
-        num_to_save = num_samples_per_traj
-        if remove_skipped_steps:
-            num_to_save = int(num_to_save * num_samples_per_traj_coeff)
-        max_size = min(num_to_save, horizon)
-        indices_to_save = np.sort(np.random.choice(horizon, size=max_size, replace=False))
+    if indices is None:
+        indices_to_save = sample_trajectory_indices(
+            traj_reader, remove_skipped_steps=remove_skipped_steps, num_samples_per_traj=num_samples_per_traj
+        )
     else:
-        indices_to_save = np.arange(horizon)
-
-    # Iterate Over Trajectory #
-    for i in indices_to_save:
-        # Get HDF5 Data #
-        timestep = traj_reader.read_timestep(index=i)
-
-        # If Applicable, Get Recorded Data #
-        if read_recording_folderpath:
-            timestamp_dict = timestep["observation"]["timestamp"]["cameras"]
-            camera_type_dict = {
-                k: camera_type_to_string_dict[v] for k, v in timestep["observation"]["camera_type"].items()
-            }
-            camera_obs = camera_reader.read_cameras(
-                index=i, camera_type_dict=camera_type_dict, timestamp_dict=timestamp_dict
-            )
-            camera_failed = camera_obs is None
-
-            # Add Data To Timestep If Successful #
-            if camera_failed:
-                break
-            else:
-                timestep["observation"].update(camera_obs)
-
-        # Filter Steps #
-        step_skipped = not timestep["observation"]["controller_info"].get("movement_enabled", True)
-        delete_skipped_step = step_skipped and remove_skipped_steps
-
-        # Save Filtered Timesteps #
-        if delete_skipped_step:
-            del timestep
-        else:
-            timestep_list.append(timestep)
+        indices_to_save = np.unique(np.asarray(indices, dtype=int))
+
+    # Bulk Read Low Dimensional Data #
+    columns = traj_reader.read_indices(indices_to_save)
+
+    # If Applicable, Get Embedded (Or Pre-Decoded) Images #
+    if traj_reader.has_images() and len(indices_to_save):
+        image_dict, keep_mask = traj_reader.read_image_indices(indices_to_save)
+
+        # Drop Timesteps Past The End Of An Embedded Video #
+        if not keep_mask.all():
+            columns = index_nested_dict(columns, keep_mask)
+        columns["observation"]["image"] = image_dict
+
+    # If Applicable, Get Recorded Data #
+    if read_recording_folderpath and len(indices_to_save):
+        camera_type_dict = {
+            k: camera_type_to_string_dict[v[0]] for k, v in columns["observation"]["camera_type"].items()
+        }
+
+        timestamp_dict = columns["observation"]["timestamp"]["cameras"]
+        camera_obs, keep_mask = camera_reader.read_frames(
+            indices_to_save,
+            camera_type_dict=camera_type_dict,
+            timestamp_dict=timestamp_dict,
+            timestamp_tolerance=timestamp_tolerance,
+        )
 
-    # Remove Extra Transitions #
-    timestep_list = np.array(timestep_list)
-    if (num_samples_per_traj is not None) and (len(timestep_list) > num_samples_per_traj):
-        ind_to_keep = np.random.choice(len(timestep_list), size=num_samples_per_traj, replace=False)
-        timestep_list = timestep_list[ind_to_keep]
+        # Drop Timesteps Without A Frame From Every Camera #
+        if not keep_mask.all():
+            columns = index_nested_dict(columns, keep_mask)
+        columns["observation"].update(camera_obs)
 
     # Close Readers #
     traj_reader.close()
@@ -388,7 +453,7 @@ def load_trajectory(
         camera_reader.disable_cameras()
 
     # Return Data #
-    return timestep_list
+    return columns
 
 
 def visualize_timestep(timestep, max_width=1000, max_height=500, aspect_ratio=1.5, pause_time=15):
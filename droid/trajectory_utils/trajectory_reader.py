@@ -1,20 +1,11 @@
-import tempfile
+import subprocess
+from queue import Full, Queue
 
 import h5py
-import imageio
+import imageio_ffmpeg
+import numpy as np
 
-
-def create_video_file(suffix=".mp4", byte_contents=None):
-    # Create Temporary File #
-    temp_file = tempfile.NamedTemporaryFile(suffix=suffix)
-    filename = temp_file.name
-
-    # If Byte Contents Provided, Write To File #
-    if byte_contents is not None:
-        with open(filename, "wb") as binary_file:
-            binary_file.write(byte_contents)
-
-    return filename
+from droid.misc.subprocess_utils import run_threaded_command
 
 
 def get_hdf5_length(hdf5_file, keys_to_ignore=[]):
@@ -57,18 +48,199 @@ def load_hdf5_to_dict(hdf5_file, index, keys_to_ignore=[]):
     return data_dict
 
 
+def index_nested_dict(data_dict, index):
+    indexed_dict = {}
+
+    for key, curr_data in data_dict.items():
+        if isinstance(curr_data, dict):
+            indexed_dict[key] = index_nested_dict(curr_data, index)
+        else:
+            indexed_dict[key] = curr_data[index]
+
+    return indexed_dict
+
+
+def split_columns_to_timesteps(columns, length=None):
+    if length is None:
+        length = get_columns_length(columns)
+    return [index_nested_dict(columns, i) for i in range(length)]
+
+
+def get_columns_length(columns):
+    for curr_data in columns.values():
+        if isinstance(curr_data, dict):
+            length = get_columns_length(curr_data)
+            if length is not None:
+                return length
+        else:
+            return len(curr_data)
+    return None
+
+
+def is_same_branch(keys_a, keys_b):
+    # True If One Path Contains The Other #
+    shared_length = min(len(keys_a), len(keys_b))
+    return keys_a[:shared_length] == keys_b[:shared_length]
+
+
+class HDF5Index:
+    """
+    Flattened index of every group and dataset in an HDF5 file (path -> dataset, shape, dtype), built with a single
+    walk. Filtered views for a given keys_to_ignore / keys selection are computed once and cached.
+    """
+
+    def __init__(self, hdf5_file, keys_to_ignore=[]):
+        self.nodes = []
+        self.shapes, self.dtypes = {}, {}
+        self._filter_cache = {}
+        self._build(hdf5_file, (), keys_to_ignore)
+
+    def _build(self, group, parent_keys, keys_to_ignore):
+        for key in group.keys():
+            if key in keys_to_ignore:
+                continue
+
+            curr_keys = (*parent_keys, key)
+            curr_data = group[key]
+            if isinstance(curr_data, h5py.Group):
+                self.nodes.append((parent_keys, key, curr_keys, None))
+                self._build(curr_data, curr_keys, keys_to_ignore)
+            elif isinstance(curr_data, h5py.Dataset):
+                path = "/".join(curr_keys)
+                self.nodes.append((parent_keys, key, curr_keys, curr_data))
+                self.shapes[path], self.dtypes[path] = curr_data.shape, curr_data.dtype
+            else:
+                raise ValueError
+
+    def length(self):
+        length = None
+
+        for shape in self.shapes.values():
+            if length is None:
+                length = shape[0]
+            assert shape[0] == length
+
+        return length
+
+    def filter(self, keys_to_ignore=[], keys=None):
+        cache_key = (tuple(keys_to_ignore), None if keys is None else tuple(keys))
+        if cache_key in self._filter_cache:
+            return self._filter_cache[cache_key]
+
+        requested_keys = None if keys is None else [tuple(path.strip("/").split("/")) for path in keys]
+        filtered_nodes = []
+
+        for node in self.nodes:
+            curr_keys = node[2]
+            if any(key in keys_to_ignore for key in curr_keys):
+                continue
+
+            # Keep Requested Paths, Their Ancestors, And Their Descendants #
+            if requested_keys is not None:
+                if not any(is_same_branch(curr_keys, req_keys) for req_keys in requested_keys):
+                    continue
+
+            filtered_nodes.append(node)
+
+        self._filter_cache[cache_key] = filtered_nodes
+        return filtered_nodes
+
+    def read(self, selection, keys_to_ignore=[], keys=None):
+        group_dicts = {(): {}}
+
+        for parent_keys, key, curr_keys, dataset in self.filter(keys_to_ignore=keys_to_ignore, keys=keys):
+            if dataset is None:
+                group_dicts[parent_keys][key] = group_dicts[curr_keys] = {}
+            else:
+                group_dicts[parent_keys][key] = dataset[selection]
+
+        return group_dicts[()]
+
+
+class EmbeddedVideoDecoder:
+    """
+    Decodes a video stored as bytes in an HDF5 dataset (see HDF5VideoWriter) without staging it on disk. A feeder
+    thread pipes the bytes into ffmpeg, and a decode thread prefetches up to `prefetch_size` frames ahead of the reader.
+    """
+
+    def __init__(self, dataset, prefetch_size=16, chunk_bytes=2**20):
+        height, width = dataset.attrs["frame_shape"][:2]
+        self._frame_shape = (height, width, 3)
+        self._dataset = dataset
+        self._chunk_bytes = chunk_bytes
+        self._frame_queue = Queue(maxsize=prefetch_size)
+        self._running = True
+        self._finished = False
+
+        # Fragmented MP4s Can Be Demuxed Without Seeking #
+        ffmpeg_command = [imageio_ffmpeg.get_ffmpeg_exe(), "-v", "error", "-f", "mp4", "-i", "pipe:0"]
+        ffmpeg_command += ["-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+        self._process = subprocess.Popen(ffmpeg_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        run_threaded_command(self._feed_bytes)
+        run_threaded_command(self._decode_frames)
+
+    def _feed_bytes(self):
+        try:
+            for start in range(0, len(self._dataset), self._chunk_bytes):
+                if not self._running:
+                    break
+                self._process.stdin.write(self._dataset[start : start + self._chunk_bytes].tobytes())
+            self._process.stdin.close()
+        except (OSError, ValueError):
+            pass
+
+    def _decode_frames(self):
+        frame_nbytes = int(np.prod(self._frame_shape))
+
+        while self._running:
+            frame = np.empty(self._frame_shape, dtype=np.uint8)
+            num_read = self._process.stdout.readinto(frame)
+            if num_read < frame_nbytes:
+                break
+            self._put_frame(frame)
+
+        self._put_frame(None)
+
+    def _put_frame(self, frame):
+        while self._running:
+            try:
+                self._frame_queue.put(frame, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def read_frame(self):
+        # Returns None Once The Video Is Exhausted #
+        if self._finished:
+            return None
+        frame = self._frame_queue.get()
+        self._finished = frame is None
+        return frame
+
+    def close(self):
+        self._running = False
+        self._process.kill()
+        self._process.wait()
+
+
 class TrajectoryReader:
-    def __init__(self, filepath, read_images=True):
+    def __init__(self, filepath, read_images=True, prefetch_size=16):
         self._hdf5_file = h5py.File(filepath, "r")
-        is_video_folder = "observations/videos" in self._hdf5_file
+        is_video_folder = "observation/videos" in self._hdf5_file
         self._read_images = read_images and is_video_folder
-        self._length = get_hdf5_length(self._hdf5_file)
+        self._hdf5_index = HDF5Index(self._hdf5_file, keys_to_ignore=["videos"])
+        self._length = self._hdf5_index.length()
+        self._prefetch_size = prefetch_size
         self._video_readers = {}
         self._index = 0
 
     def length(self):
         return self._length
 
+    def has_images(self):
+        return self._read_images
+
     def read_timestep(self, index=None, keys_to_ignore=[]):
         # Make Sure We Read Within Range #
         if index is None:
@@ -79,13 +251,12 @@ class TrajectoryReader:
         assert index < self._length
 
         # Load Low Dimensional Data #
-        keys_to_ignore = [*keys_to_ignore.copy(), "videos"]
-        timestep = load_hdf5_to_dict(self._hdf5_file, self._index, keys_to_ignore=keys_to_ignore)
+        timestep = self._hdf5_index.read(self._index, keys_to_ignore=keys_to_ignore)
 
         # Load High Dimensional Data #
         if self._read_images:
             camera_obs = self._uncompress_images()
-            timestep["observations"]["image"] = camera_obs
+            timestep["observation"]["image"] = camera_obs
 
         # Increment Read Index #
         self._index += 1
@@ -93,24 +264,99 @@ class TrajectoryReader:
         # Return Timestep #
         return timestep
 
-    def _uncompress_images(self):
-        # WARNING: THIS FUNCTION HAS NOT BEEN TESTED. UNDEFINED BEHAVIOR FOR FAILED READING. #
-        video_folder = self._hdf5_file["observations/videos"]
-        camera_obs = {}
+    def read_range(self, start=0, stop=None, keys=None, keys_to_ignore=[]):
+        """
+        Reads timesteps [start, stop) with one read per dataset, and returns them as a nested dictionary of columns.
+        - keys optionally restricts the read to a list of paths (ex: ["action", "observation/robot_state"])
+        - Use index_nested_dict(columns, i) to get a single timestep back
+        """
+        if stop is None:
+            stop = self._length
+        assert 0 <= start <= stop <= self._length
+        return self._read_columns(slice(start, stop), keys=keys, keys_to_ignore=keys_to_ignore)
+
+    def read_indices(self, indices, keys=None, keys_to_ignore=[], max_span_ratio=4):
+        """
+        Reads an arbitrary array of timesteps with one read per dataset, and returns them as a nested dictionary of
+        columns ordered like `indices`. Dense selections read their covering range, sparse ones use fancy indexing.
+        """
+        indices = np.asarray(indices, dtype=int)
+        assert np.all((indices >= 0) & (indices < self._length))
+        if not len(indices):
+            return self.read_range(0, 0, keys=keys, keys_to_ignore=keys_to_ignore)
+
+        # HDF5 Requires Sorted, Unique Selections #
+        unique_indices, inverse = np.unique(indices, return_inverse=True)
+        span = unique_indices[-1] - unique_indices[0] + 1
+
+        if span <= max_span_ratio * len(unique_indices):
+            selection = slice(unique_indices[0], unique_indices[-1] + 1)
+            take_indices = indices - unique_indices[0]
+        else:
+            selection = unique_indices
+            take_indices = inverse
+
+        columns = self._read_columns(selection, keys=keys, keys_to_ignore=keys_to_ignore)
+        return index_nested_dict(columns, take_indices)
 
-        for video_id in video_folder:
-            # Create Video Reader If One Hasn't Been Made #
-            if video_id not in self._video_readers:
-                serialized_video = video_folder[video_id]
-                filename = create_video_file(byte_contents=serialized_video)
-                self._video_readers[video_id] = imageio.get_reader(filename)
+    def _read_columns(self, selection, keys=None, keys_to_ignore=[]):
+        return self._hdf5_index.read(selection, keys_to_ignore=keys_to_ignore, keys=keys)
 
-            # Read Next Frame #
-            camera_obs[video_id] = yield self._video_readers[video_id]
-            # Future Note: Could Make Thread For Each Image Reader
+    def read_image_indices(self, indices):
+        """
+        Decodes the embedded videos from the start (one thread per camera), keeping only the frames at `indices`.
+        Returns ({video id: (N, H, W, 3) frames}, keep_mask), with frames ordered like the kept `indices`.
+        - Videos can end before the trajectory (ex: dropped frames), so keep_mask marks the timesteps every video
+          still had a frame for
+        """
+        indices = np.asarray(indices, dtype=int)
+        unique_indices, inverse = np.unique(indices, return_inverse=True)
+        indices_to_keep = set(unique_indices.tolist())
+        video_folder = self._hdf5_file["observation/videos"]
+        video_readers = {}
+        frame_dict = {video_id: [] for video_id in video_folder}
+
+        try:
+            for video_id in video_folder:
+                video_readers[video_id] = EmbeddedVideoDecoder(video_folder[video_id], prefetch_size=self._prefetch_size)
+
+            # Keep Only Requested Frames, Stopping At The End Of The Shortest Video #
+            for frame_index in range(unique_indices[-1] + 1 if len(unique_indices) else 0):
+                frames = {video_id: video_reader.read_frame() for video_id, video_reader in video_readers.items()}
+                if any(frame is None for frame in frames.values()):
+                    break
+                if frame_index in indices_to_keep:
+                    for video_id, frame in frames.items():
+                        frame_dict[video_id].append(frame)
+        finally:
+            for video_reader in video_readers.values():
+                video_reader.close()
+
+        num_kept = min([len(frames) for frames in frame_dict.values()], default=len(unique_indices))
+        keep_mask = inverse < num_kept
+        frame_dict = {
+            video_id: np.stack(frames)[inverse[keep_mask]] for video_id, frames in frame_dict.items() if len(frames)
+        }
+        return frame_dict, keep_mask
+
+    def _uncompress_images(self):
+        # Start One Decode Thread Per Camera #
+        if not self._video_readers:
+            video_folder = self._hdf5_file["observation/videos"]
+            for video_id in video_folder:
+                self._video_readers[video_id] = EmbeddedVideoDecoder(
+                    video_folder[video_id], prefetch_size=self._prefetch_size
+                )
+
+        # Read Next Frames #
+        camera_obs = {}
+        for video_id, video_reader in self._video_readers.items():
+            camera_obs[video_id] = video_reader.read_frame()
 
         # Return Camera Observation #
         return camera_obs
 
     def close(self):
+        for video_reader in self._video_readers.values():
+            video_reader.close()
         self._hdf5_file.close()
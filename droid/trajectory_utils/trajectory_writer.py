@@ -1,14 +1,15 @@
 import os
 import tempfile
-from collections import defaultdict
+import threading
 from copy import deepcopy
-from queue import Empty, Queue
+from queue import Empty, Full, Queue
 
 import h5py
 import imageio
 import numpy as np
 
 from droid.misc.subprocess_utils import run_threaded_command
+from droid.misc.time import time_ms
 
 
 def write_dict_to_hdf5(hdf5_file, data_dict, keys_to_ignore=["image", "depth", "pointcloud"]):
@@ -44,57 +45,459 @@ def write_dict_to_hdf5(hdf5_file, data_dict, keys_to_ignore=["image", "depth", "
         hdf5_file[key][-1] = curr_data
 
 
+class TimestepSchema:
+    """
+    Flat description (path -> dtype / shape) of a nested timestep dictionary, compiled once from the first timestep.
+    Later timesteps are read through precomputed leaf accessors, and any structural change raises a ValueError.
+    """
+
+    def __init__(self, data_dict, keys_to_ignore=["image", "depth", "pointcloud"]):
+        self.keys_to_ignore = keys_to_ignore
+        self.paths, self.dtypes, self.shapes, self.group_paths = [], [], [], []
+        self._accessors, self._groups = [], []
+        self._compile(data_dict, ())
+        self.row_nbytes = sum(dtype.itemsize * int(np.prod(shape)) for dtype, shape in zip(self.dtypes, self.shapes))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _compile(self, data_dict, accessor):
+        expected_keys = {key for key in data_dict.keys() if key not in self.keys_to_ignore}
+        has_ignored_keys = len(expected_keys) != len(data_dict)
+        self._groups.append((accessor, len(data_dict), expected_keys, has_ignored_keys))
+        self.group_paths.append("/".join(accessor))
+
+        for key in data_dict.keys():
+            # Pass Over Specified Keys #
+            if key in self.keys_to_ignore:
+                continue
+
+            # Unwrap If Dictionary #
+            curr_data = data_dict[key]
+            if isinstance(curr_data, dict):
+                self._compile(curr_data, (*accessor, key))
+                continue
+
+            # Record Leaf #
+            if isinstance(curr_data, list):
+                curr_data = np.array(curr_data)
+            if isinstance(curr_data, np.ndarray):
+                dtype, dshape = curr_data.dtype, curr_data.shape
+            else:
+                dtype, dshape = np.dtype(type(curr_data)), ()
+
+            self.paths.append("/".join((*accessor, key)))
+            self.dtypes.append(dtype)
+            self.shapes.append(dshape)
+            self._accessors.append((*accessor, key))
+
+    def extract(self, data_dict):
+        # Check Group Structure #
+        for accessor, num_keys, expected_keys, has_ignored_keys in self._groups:
+            group = data_dict
+            try:
+                for key in accessor:
+                    group = group[key]
+            except (KeyError, TypeError):
+                raise ValueError(
+                    f"Timestep does not match trajectory schema: missing group `{'/'.join(accessor)}`"
+                ) from None
+            # A Matching Count Can Hide A Dropped Ignored Key Plus A New One, So Those Groups Compare Key Sets #
+            if has_ignored_keys or (len(group) != num_keys):
+                self._check_group_keys(group, accessor, expected_keys)
+
+        # Gather Leaves #
+        values = []
+        for i, accessor in enumerate(self._accessors):
+            curr_data = data_dict
+            try:
+                for key in accessor:
+                    curr_data = curr_data[key]
+            except (KeyError, TypeError):
+                raise ValueError(f"Timestep does not match trajectory schema: missing key `{self.paths[i]}`") from None
+
+            if np.shape(curr_data) != self.shapes[i]:
+                raise ValueError(
+                    f"Timestep does not match trajectory schema: `{self.paths[i]}` has shape {np.shape(curr_data)}, "
+                    f"expected {self.shapes[i]}"
+                )
+            values.append(curr_data)
+
+        return values
+
+    def _check_group_keys(self, group, accessor, expected_keys):
+        curr_keys = {key for key in group.keys() if key not in self.keys_to_ignore}
+        new_keys = curr_keys - expected_keys
+        if new_keys:
+            new_paths = sorted("/".join((*accessor, key)) for key in new_keys)
+            raise ValueError(f"Timestep does not match trajectory schema: unexpected keys {new_paths}")
+
+
+def get_chunk_length(row_shape, dtype, target_chunk_bytes=2**16, max_chunk_length=1024):
+    row_nbytes = max(np.dtype(dtype).itemsize * int(np.prod(row_shape)), 1)
+    return int(np.clip(target_chunk_bytes // row_nbytes, 1, max_chunk_length))
+
+
+class HDF5ColumnWriter:
+    """
+    Buffers each leaf of the timestep dictionary as an in-memory column, and flushes the columns in blocks of
+    `flush_length` timesteps to chunked (and optionally compressed) datasets.
+    - The dataset layout is compiled from the first timestep (see TimestepSchema)
+    - If chunk_length is None, each dataset gets chunks of roughly `target_chunk_bytes`
+    - Data that has not been flushed yet is lost if the process dies, so keep `flush_length` modest
+    """
+
+    def __init__(
+        self,
+        hdf5_file,
+        flush_length=128,
+        chunk_length=None,
+        target_chunk_bytes=2**16,
+        compression=None,
+        compression_opts=None,
+        keys_to_ignore=["image", "depth", "pointcloud"],
+    ):
+        self._hdf5_file = hdf5_file
+        self._flush_length = flush_length
+        self._chunk_length = chunk_length
+        self._target_chunk_bytes = target_chunk_bytes
+        self._compression = compression
+        self._compression_opts = compression_opts
+        self.keys_to_ignore = keys_to_ignore
+        self.schema = None
+        self._datasets = None
+        self._columns = []
+        self._num_buffered = 0
+
+    def write(self, data_dict):
+        # Compile Schema From First Timestep #
+        if self.schema is None:
+            self.set_schema(TimestepSchema(data_dict, keys_to_ignore=self.keys_to_ignore))
+        return self.write_values(self.schema.extract(data_dict))
+
+    def set_schema(self, schema):
+        # Datasets Are Only Created On The First Write, So This Stays Cheap For The Caller #
+        assert self.schema is None
+        self.schema = schema
+
+    def write_values(self, values):
+        # Values Of One Timestep, As Returned By self.schema.extract #
+        if self._datasets is None:
+            self._create_datasets()
+
+        # Add Timestep To Buffers #
+        for column, curr_data in zip(self._columns, values):
+            column.append(curr_data)
+
+        self._num_buffered += 1
+        if self._num_buffered >= self._flush_length:
+            self.flush()
+
+        return self.schema.row_nbytes
+
+    def flush(self):
+        if not self._num_buffered:
+            return
+
+        for dataset, column, dtype in zip(self._datasets, self._columns, self.schema.dtypes):
+            # Stack Column Into A Single Block #
+            block = np.asarray(column, dtype=dtype)
+
+            # Make Room For Data #
+            start = dataset.shape[0]
+            dataset.resize(start + len(block), axis=0)
+
+            # Save Data #
+            dataset[start:] = block
+            column.clear()
+
+        self._num_buffered = 0
+
+    def _create_datasets(self):
+        self._datasets = []
+        for group_path in self.schema.group_paths[1:]:
+            self._hdf5_file.require_group(group_path)
+        for path, dtype, dshape in zip(self.schema.paths, self.schema.dtypes, self.schema.shapes):
+            self._datasets.append(self._create_dataset(path, dtype, dshape))
+            self._columns.append([])
+
+    def _create_dataset(self, path, dtype, dshape):
+        if 0 in dshape:
+            chunks = True
+        else:
+            chunk_length = self._chunk_length
+            if chunk_length is None:
+                chunk_length = get_chunk_length(dshape, dtype, target_chunk_bytes=self._target_chunk_bytes)
+            chunks = (chunk_length, *dshape)
+
+        return self._hdf5_file.create_dataset(
+            path,
+            (0, *dshape),
+            maxshape=(None, *dshape),
+            dtype=dtype,
+            chunks=chunks,
+            compression=self._compression,
+            compression_opts=self._compression_opts,
+        )
+
+
+class WriterQueue:
+    """
+    Queue feeding one of the TrajectoryWriter threads, with optional backpressure and live write statistics.
+    - A maxsize of 0 leaves the queue unbounded
+    - When the queue is full, policy "block" makes the caller wait, while policy "drop" discards the new item
+    - Dropping video frames or timesteps desynchronizes them from the rest of the trajectory, so only drop when
+      keeping the control loop on time matters more than the data
+    """
+
+    def __init__(self, maxsize=0, policy="block"):
+        assert policy in ["block", "drop"]
+        self._queue = Queue(maxsize=maxsize)
+        self._policy = policy
+        self._lock = threading.Lock()
+        self._start_time = None
+        self._num_written = 0
+        self._num_dropped = 0
+        self._bytes_written = 0
+        self._latency_ms = 0.0
+        self._max_latency_ms = 0.0
+
+    def put(self, data):
+        if self._start_time is None:
+            self._start_time = time_ms()
+        item = (time_ms(), data)
+
+        if self._policy == "block":
+            self._queue.put(item)
+            return True
+
+        try:
+            self._queue.put_nowait(item)
+        except Full:
+            with self._lock:
+                self._num_dropped += 1
+            return False
+        return True
+
+    def get(self, timeout=None):
+        return self._queue.get(timeout=timeout)
+
+    def task_done(self, enqueue_time, nbytes=0):
+        latency_ms = float(time_ms() - enqueue_time)
+        with self._lock:
+            self._num_written += 1
+            self._bytes_written += nbytes
+            self._latency_ms = latency_ms
+            self._max_latency_ms = max(self._max_latency_ms, latency_ms)
+        self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+    def get_stats(self):
+        with self._lock:
+            elapsed_sec = 0 if self._start_time is None else (time_ms() - self._start_time) / 1000
+            bytes_per_sec = self._bytes_written / elapsed_sec if elapsed_sec > 0 else 0.0
+            return {
+                "queue_depth": self._queue.qsize(),
+                "num_written": self._num_written,
+                "num_dropped": self._num_dropped,
+                "latency_ms": self._latency_ms,
+                "max_latency_ms": self._max_latency_ms,
+                "bytes_per_sec": float(bytes_per_sec),
+            }
+
+
+def merge_queue_stats(stats_list):
+    merged_stats = {
+        "queue_depth": 0,
+        "num_written": 0,
+        "num_dropped": 0,
+        "latency_ms": 0.0,
+        "max_latency_ms": 0.0,
+        "bytes_per_sec": 0.0,
+    }
+
+    for stats in stats_list:
+        for key in ["queue_depth", "num_written", "num_dropped", "bytes_per_sec"]:
+            merged_stats[key] += stats[key]
+        for key in ["latency_ms", "max_latency_ms"]:
+            merged_stats[key] = max(merged_stats[key], stats[key])
+
+    return merged_stats
+
+
+class HDF5VideoWriter:
+    """
+    Encodes frames into a fragmented MP4, and streams the encoded bytes into a resizable uint8 HDF5 dataset while
+    recording. ffmpeg writes into a named pipe, so nothing is staged on disk.
+    - A keyframe (and fragment) every `fragment_sec` seconds makes ffmpeg emit the video as it is recorded, so encoder
+      memory stays bounded and close() only has the last fragment left to write
+    - chunk_bytes: Maximum number of bytes read from the pipe at once (each read is appended straight to HDF5)
+    """
+
+    def __init__(self, dataset, fifo_path, chunk_bytes=2**20, fps=10, fragment_sec=1):
+        self._dataset = dataset
+        self._fifo_path = fifo_path
+        self._chunk_bytes = chunk_bytes
+
+        # Start Pumping Encoded Bytes Into HDF5 #
+        os.mkfifo(fifo_path)
+        self._pump_thread = run_threaded_command(self._pump_bytes)
+
+        # Fragmented MP4s Never Seek Backwards, So They Can Be Written To A Pipe #
+        keyframe_interval = max(int(round(fps * fragment_sec)), 1)
+        self._writer = imageio.get_writer(
+            fifo_path,
+            format="FFMPEG",
+            fps=fps,
+            macro_block_size=1,
+            output_params=[
+                "-g",
+                str(keyframe_interval),
+                "-movflags",
+                "frag_keyframe+empty_moov",
+                "-frag_duration",
+                str(int(fragment_sec * 1e6)),
+            ],
+        )
+
+    def append_data(self, img):
+        self._writer.append_data(img)
+
+    def _pump_bytes(self):
+        with open(self._fifo_path, "rb", buffering=0) as fifo:
+            while True:
+                data = fifo.read(self._chunk_bytes)
+                if not data:
+                    break
+                self._append_bytes(data)
+
+    def _append_bytes(self, data):
+        start = self._dataset.shape[0]
+        self._dataset.resize(start + len(data), axis=0)
+        self._dataset[start:] = np.frombuffer(data, dtype=np.uint8)
+
+    def close(self):
+        self._writer.close()
+
+        # Unblock The Pump If ffmpeg Never Opened The Pipe #
+        try:
+            os.close(os.open(self._fifo_path, os.O_WRONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+
+        self._pump_thread.join()
+        os.remove(self._fifo_path)
+
+
 class TrajectoryWriter:
-    def __init__(self, filepath, metadata=None, exists_ok=False, save_images=True):
+    """
+    Writes timesteps to an HDF5 file (and optionally videos) from background threads.
+    - queue_kwargs maps a stream ("hdf5", "video", or a specific video id) to WriterQueue arguments
+    - Videos are streamed into observation/videos/<video_id> while recording (see HDF5VideoWriter)
+    - Timesteps that do not match the first one's schema raise a ValueError in write_timestep, and errors on the
+      writer threads are raised from the next write_timestep or close call
+    """
+
+    def __init__(
+        self,
+        filepath,
+        metadata=None,
+        exists_ok=False,
+        save_images=True,
+        buffered=False,
+        buffer_kwargs={},
+        queue_kwargs={},
+        video_kwargs={},
+    ):
         assert (not os.path.isfile(filepath)) or exists_ok
         self._filepath = filepath
         self._save_images = save_images
         self._hdf5_file = h5py.File(filepath, "w")
-        self._queue_dict = defaultdict(Queue)
+        self._queue_kwargs = queue_kwargs
+        self._queue_dict = {"hdf5": WriterQueue(**queue_kwargs.get("hdf5", {}))}
+        self._video_kwargs = video_kwargs
         self._video_writers = {}
-        self._video_files = {}
+        self._write_errors = []
         self._open = True
 
         # Add Metadata #
         if metadata is not None:
             self._update_metadata(metadata)
 
+        # Prepare Video Folder #
+        if save_images:
+            self._video_folder = self._hdf5_file.create_group("observation/videos")
+            self._fifo_dir = tempfile.TemporaryDirectory()
+
         # Start HDF5 Writer Thread #
-        def hdf5_writer(data):
-            return write_dict_to_hdf5(self._hdf5_file, data)
+        if not buffered:
+            buffer_kwargs = {**buffer_kwargs, "flush_length": 1}
+        self._column_writer = HDF5ColumnWriter(self._hdf5_file, **buffer_kwargs)
+        hdf5_writer = self._column_writer.write_values
 
         run_threaded_command(self._write_from_queue, args=(hdf5_writer, self._queue_dict["hdf5"]))
 
     def write_timestep(self, timestep):
+        self._raise_write_error()
+
+        # Extract Once, Here, So Schema Mismatches Raise On The Caller's Thread #
+        if self._column_writer.schema is None:
+            schema = TimestepSchema(timestep, keys_to_ignore=self._column_writer.keys_to_ignore)
+            self._column_writer.set_schema(schema)
+        values = self._column_writer.schema.extract(timestep)
+
         if self._save_images:
             self._update_video_files(timestep)
-        self._queue_dict["hdf5"].put(timestep)
+        self._queue_dict["hdf5"].put(values)
 
     def _update_metadata(self, metadata):
         for key in metadata:
             self._hdf5_file.attrs[key] = deepcopy(metadata[key])
 
+    def get_queue_stats(self):
+        return {stream_id: queue.get_stats() for stream_id, queue in self._queue_dict.items()}
+
+    def get_writer_stats(self):
+        # Fixed Layout, So It Can Be Logged Alongside Every Timestep #
+        queue_stats = self.get_queue_stats()
+        video_stats = [stats for stream_id, stats in queue_stats.items() if stream_id != "hdf5"]
+        return {"hdf5": queue_stats["hdf5"], "video": merge_queue_stats(video_stats)}
+
     def _write_from_queue(self, writer, queue):
+        failed = False
         while self._open:
             try:
-                data = queue.get(timeout=1)
+                enqueue_time, data = queue.get(timeout=1)
             except Empty:
                 continue
-            writer(data)
-            queue.task_done()
 
-    def _update_video_files(self, timestep):
-        image_dict = timestep["observations"]["image"]
+            # After An Error, Keep Draining The Queue So close() Never Blocks On It #
+            nbytes = 0
+            if not failed:
+                try:
+                    nbytes = writer(data)
+                    if nbytes is None:
+                        nbytes = getattr(data, "nbytes", 0)
+                except Exception as error:
+                    self._write_errors.append(error)
+                    failed = True
+            queue.task_done(enqueue_time, nbytes)
 
-        for video_id in image_dict:
-            # Get Frame #
-            img = image_dict[video_id]
-            del image_dict[video_id]
+    def _raise_write_error(self):
+        if self._write_errors:
+            raise self._write_errors[0]
 
-            # Create Writer And Buffer #
-            if video_id not in self._video_buffers:
-                filename = self.create_video_file(video_id, ".mp4")
-                self._video_writers[video_id] = imageio.get_writer(filename, macro_block_size=1)
+    def _update_video_files(self, timestep):
+        image_dict = timestep["observation"].pop("image")
+
+        for video_id, img in image_dict.items():
+            # Create Writer And Queue #
+            if video_id not in self._video_writers:
+                video_queue_kwargs = self._queue_kwargs.get(video_id, self._queue_kwargs.get("video", {}))
+                self._queue_dict[video_id] = WriterQueue(**video_queue_kwargs)
+                self._video_writers[video_id] = self.create_video_writer(video_id, img.shape)
                 run_threaded_command(
                     self._write_from_queue, args=(self._video_writers[video_id].append_data, self._queue_dict[video_id])
                 )
@@ -102,12 +505,11 @@ class TrajectoryWriter:
             # Add Image To Queue #
             self._queue_dict[video_id].put(img)
 
-        del timestep["observations"]["image"]
-
-    def create_video_file(self, video_id, suffix):
-        temp_file = tempfile.NamedTemporaryFile(suffix=suffix)
-        self._video_files[video_id] = temp_file
-        return temp_file.name
+    def create_video_writer(self, video_id, frame_shape):
+        dataset = self._video_folder.create_dataset(video_id, (0,), maxshape=(None,), dtype=np.uint8, chunks=(2**16,))
+        dataset.attrs["frame_shape"] = frame_shape
+        fifo_path = os.path.join(self._fifo_dir.name, video_id + ".mp4")
+        return HDF5VideoWriter(dataset, fifo_path, **self._video_kwargs)
 
     def close(self, metadata=None):
         # Add Metadata #
@@ -116,25 +518,18 @@ class TrajectoryWriter:
 
         # Finish Remaining Jobs #
         [queue.join() for queue in self._queue_dict.values()]
+        try:
+            self._column_writer.flush()
+        except Exception as error:
+            self._write_errors.append(error)
 
-        # Close Video Writers #
-        for video_id in self._video_writers:
-            self._video_writers[video_id].close()
-
-        # Save Serialized Videos #
-        for video_id in self._video_files:
-            # Create Folder #
-            if "videos" not in self._hdf5_file["observations"]:
-                self._hdf5_file["observations"].create_group("videos")
-
-            # Get Serialized Video #
-            self._video_files[video_id].seek(0)
-            serialized_video = np.asarray(self._video_files[video_id].read())
-
-            # Save Data #
-            self._hdf5_file["observations"]["videos"].create_dataset(video_id, data=serialized_video)
-            self._video_files[video_id].close()
+        # Close Video Writers (Only The Final Fragment Is Left To Stream) #
+        close_threads = [run_threaded_command(writer.close) for writer in self._video_writers.values()]
+        [thread.join() for thread in close_threads]
+        if self._save_images:
+            self._fifo_dir.cleanup()
 
         # Close File #
         self._hdf5_file.close()
         self._open = False
+        self._raise_write_error()
@@ -0,0 +1,90 @@
+"""
+Script for pre-decoding recorded MP4 data into memory-mappable frame stores for training.
+
+Performs the following:
+    - Finds every trajectory folder under `data_dir` with a `trajectory.h5` and a `recordings/<recording_prefix>` folder.
+    - Decodes and resizes each camera once, writing `recordings/<store_prefix>/<image key>.npy` plus a low-dim
+      column store.
+    - Skips trajectories whose store is already complete, so an interrupted run can simply be restarted.
+
+Load the result by passing `recording_prefix=<store_prefix>` to `create_dataloader` / `TrajectorySampler`.
+
+Run from DROID directory root with: `python scripts/convert/to_frame_store.py --data_dir data/success'
+"""
+
+import os
+import traceback
+from dataclasses import dataclass
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Tuple
+
+import pyrallis
+import tqdm
+
+from droid.camera_utils.info import camera_type_to_string_dict
+from droid.data_loading.trajectory_sampler import crawler
+from droid.trajectory_utils.frame_store import convert_trajectory, is_frame_store
+
+
+@dataclass
+class FrameStoreConversionConfig:
+    # fmt: off
+    data_dir: Path = Path("data/success")           # Path to top-level directory containing trajectory folders
+    recording_prefix: str = "MP4"                   # Recording folder to decode (`recordings/<recording_prefix>`)
+    store_prefix: str = "NPY"                       # Recording folder to write frame stores to
+
+    # Frame Details
+    resolution: Tuple[int, int] = (128, 128)        # Resolution (width, height) frames are resized to
+    concatenate_images: bool = False                # Whether to keep stereo pairs side by side
+    timestamp_tolerance: int = 0                    # Maximum camera timestamp mismatch (ms) when matching frames
+    chunk_length: int = 64                          # Number of timesteps decoded before writing to the store
+
+    # Parallelism
+    num_workers: int = 8                            # Number of trajectories converted in parallel
+    # fmt: on
+
+
+def convert_folder(args):
+    folderpath, cfg = args
+    camera_kwargs = dict(resolution=cfg.resolution, resize_func="cv2", concatenate_images=cfg.concatenate_images)
+
+    try:
+        convert_trajectory(
+            os.path.join(folderpath, "trajectory.h5"),
+            os.path.join(folderpath, "recordings", cfg.recording_prefix),
+            os.path.join(folderpath, "recordings", cfg.store_prefix),
+            camera_kwargs={cam_type: camera_kwargs for cam_type in camera_type_to_string_dict.values()},
+            chunk_length=cfg.chunk_length,
+            timestamp_tolerance=cfg.timestamp_tolerance,
+        )
+    except Exception:
+        return folderpath, traceback.format_exc()
+
+    return folderpath, None
+
+
+@pyrallis.wrap()
+def convert(cfg: FrameStoreConversionConfig) -> None:
+    all_folderpaths = [
+        p
+        for p in crawler(str(cfg.data_dir))
+        if os.path.exists(os.path.join(p, "recordings", cfg.recording_prefix))
+        and not is_frame_store(os.path.join(p, "recordings", cfg.store_prefix))
+    ]
+    print(f"[*] Converting {len(all_folderpaths)} Trajectories To `recordings/{cfg.store_prefix}`")
+
+    errored_folderpaths = {}
+    with Pool(cfg.num_workers) as pool:
+        tasks = [(folderpath, cfg) for folderpath in all_folderpaths]
+        for folderpath, error in tqdm.tqdm(pool.imap_unordered(convert_folder, tasks), total=len(tasks)):
+            if error is not None:
+                errored_folderpaths[folderpath] = error
+
+    for folderpath, error in errored_folderpaths.items():
+        print(f"[!] Failed To Convert {folderpath}:\n{error}")
+    print(f"[*] Done --> {len(all_folderpaths) - len(errored_folderpaths)} Converted, {len(errored_folderpaths)} Errors")
+
+
+if __name__ == "__main__":
+    convert()
@@ -1,4 +1,5 @@
 import os
+from collections import defaultdict
 
 import numpy as np
 import tensorflow as tf
@@ -6,8 +7,10 @@ import tqdm
 from absl import app, flags, logging
 from tqdm_multiprocess import TqdmMultiProcessPool
 
+from droid.camera_utils.info import camera_type_to_string_dict
+from droid.camera_utils.wrappers.recorded_multi_camera_wrapper import RecordedMultiCameraWrapper
 from droid.data_loading.trajectory_sampler import crawler
-from droid.trajectory_utils.misc import load_trajectory
+from droid.trajectory_utils.trajectory_reader import TrajectoryReader, index_nested_dict
 
 """
 AVAILABLE KEYS:
@@ -109,8 +112,9 @@ def tensor_feature(value):
     return tf.train.Feature(bytes_list=tf.train.BytesList(value=[tf.io.serialize_tensor(value).numpy()]))
 
 
-def resize_and_encode(image, size):
-    return tf.io.encode_jpeg(tf.cast(tf.round(tf.image.resize(image, size, method="bicubic")), tf.uint8))
+def encode_frames(frames):
+    # Frames Are Encoded In Their Recorded (BGR) Channel Order, As Before #
+    return [tf.io.encode_jpeg(frame).numpy() for frame in frames]
 
 
 FLAGS = flags.FLAGS
@@ -120,6 +124,7 @@ flags.DEFINE_bool("overwrite", False, "Overwrite existing tfrecords")
 flags.DEFINE_float("train_fraction", 0.8, "Fraction of data to use for training")
 flags.DEFINE_integer("shard_size", 200, "Maximum number of trajectories per tfrecord")
 flags.DEFINE_integer("num_workers", 8, "Number of workers to use for parallel processing")
+flags.DEFINE_integer("chunk_length", 64, "Number of kept timesteps decoded at once, which bounds memory per worker")
 
 
 KEEP_KEYS = [
@@ -141,34 +146,79 @@ FRAMESKIP = 1
 IMAGE_SIZE = (180, 320)
 
 
-def create_tfrecord(paths, output_path, tqdm_func, global_tqdm):
+IMAGE_PREFIX = "observation/image/"
+
+
+def load_trajectory_features(path, chunk_length):
+    """
+    Reads the KEEP_KEYS of one trajectory as {key: (T, ...) array or list of T JPEG strings}, without loading the rest:
+    - Low dimensional keys are read in bulk, at the FRAMESKIP stride only
+    - Only cameras with kept image keys are decoded, only at kept timesteps, and resized to IMAGE_SIZE while decoding
+    - Frames are decoded `chunk_length` timesteps at a time and JPEG encoded right away
+    - Timesteps some kept camera has no frame for are dropped
+    """
+    h5_filepath = os.path.join(path, "trajectory.h5")
+    recording_folderpath = os.path.join(path, "recordings", "MP4")
+    lowdim_keys = [key for key in KEEP_KEYS if not key.startswith(IMAGE_PREFIX)]
+    image_keys = [key[len(IMAGE_PREFIX) :] for key in KEEP_KEYS if key.startswith(IMAGE_PREFIX)]
+
+    # Bulk Read Low Dimensional Data At The Kept Stride #
+    traj_reader = TrajectoryReader(h5_filepath, read_images=False)
+    indices = np.arange(0, traj_reader.length(), FRAMESKIP)
+    columns = traj_reader.read_indices(
+        indices, keys=[*lowdim_keys, "observation/camera_type", "observation/timestamp/cameras"]
+    )
+    traj_reader.close()
+
+    # Only Open Cameras Behind Kept Image Keys #
+    camera_kwargs = dict(resolution=(IMAGE_SIZE[1], IMAGE_SIZE[0]), resize_func="cv2_area")
+    camera_reader = RecordedMultiCameraWrapper(
+        recording_folderpath, {cam_type: camera_kwargs for cam_type in camera_type_to_string_dict.values()}
+    )
+    kept_serial_numbers = {image_key.split("_")[0] for image_key in image_keys}
+    for serial_number in list(camera_reader.camera_dict):
+        if serial_number not in kept_serial_numbers:
+            camera_reader.camera_dict.pop(serial_number).disable_camera()
+
+    camera_type_dict = {
+        k: camera_type_to_string_dict[v[0]] for k, v in columns["observation"]["camera_type"].items() if len(v)
+    }
+    timestamp_dict = columns["observation"]["timestamp"]["cameras"]
+
+    # Decode, Resize And Encode Frames Chunk By Chunk #
+    valid = np.zeros(len(indices), dtype=bool)
+    encoded_frames = defaultdict(list)
+    for start in range(0, len(indices), chunk_length):
+        chunk = slice(start, start + chunk_length)
+        camera_obs, keep_mask = camera_reader.read_frames(
+            indices[chunk],
+            camera_type_dict=camera_type_dict,
+            timestamp_dict={key: timestamps[chunk] for key, timestamps in timestamp_dict.items()},
+        )
+        for image_key, frames in camera_obs.get("image", {}).items():
+            if image_key in image_keys:
+                encoded_frames[IMAGE_PREFIX + image_key].extend(encode_frames(frames))
+        valid[chunk] = keep_mask
+
+    camera_reader.disable_cameras()
+
+    # Keep Timesteps With Every Frame #
+    features = flatten(index_nested_dict(columns, valid))
+    features = {key: value for key, value in features.items() if key in lowdim_keys}
+    features.update(encoded_frames)
+    return features
+
+
+def create_tfrecord(paths, output_path, chunk_length, tqdm_func, global_tqdm):
+    # Trajectories Are Written One At A Time, So A Worker Only Holds One Trajectory's Encoded Frames #
     writer = tf.io.TFRecordWriter(output_path)
 
     for path in paths:
-        h5_filepath = os.path.join(path, "trajectory.h5")
-        recording_folderpath = os.path.join(path, "recordings", "MP4")
-
-        # this is really inefficient, should really do frame skipping inside `load_trajectory` but I didn't want to mess
-        # with it for now
-        traj = load_trajectory(h5_filepath, recording_folderpath=recording_folderpath)
-        traj = traj[::FRAMESKIP]
-
-        # each element of `traj` is a possibly nested dict; flatten them and make sure they all have the same keys
-        traj_flat = [flatten(t) for t in traj]
-        assert all(t.keys() == traj_flat[0].keys() for t in traj_flat)
-
-        # convert to a single dict of lists, processing images and discarding unwanted keys along the way
-        out = {}
-        for key in traj_flat[0].keys():
-            if key not in KEEP_KEYS:
-                continue
-            if "image" in key:
-                out[key] = [resize_and_encode(t[key], IMAGE_SIZE) for t in traj_flat]
-            else:
-                out[key] = [t[key] for t in traj_flat]
-        example = tf.train.Example(features=tf.train.Features(feature={k: tensor_feature(v) for k, v in out.items()}))
-
-        writer.write(example.SerializeToString())
+        features = load_trajectory_features(path, chunk_length)
+        if any(len(value) for value in features.values()):
+            feature = {key: tensor_feature(value) for key, value in features.items()}
+            example = tf.train.Example(features=tf.train.Features(feature=feature))
+            writer.write(example.SerializeToString())
 
         global_tqdm.update(1)
 
@@ -204,9 +254,9 @@ def main(_):
     test_output_paths = [os.path.join(FLAGS.output_path, "test", f"{i}.tfrecord") for i in range(len(test_shards))]
 
     # create tasks (see tqdm_multiprocess documenation)
-    tasks = [(create_tfrecord, (train_shards[i], train_output_paths[i])) for i in range(len(train_shards))] + [
-        (create_tfrecord, (test_shards[i], test_output_paths[i])) for i in range(len(test_shards))
-    ]
+    tasks = [
+        (create_tfrecord, (train_shards[i], train_output_paths[i], FLAGS.chunk_length)) for i in range(len(train_shards))
+    ] + [(create_tfrecord, (test_shards[i], test_output_paths[i], FLAGS.chunk_length)) for i in range(len(test_shards))]
 
     # run tasks
     pool = TqdmMultiProcessPool(FLAGS.num_workers)
@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+from torchvision import transforms as T
+
+from droid.data_processing.augmentations import BatchAugmenter, augmix_ops, color_jitter, random_resized_crop
+
+# Three Stereo Cameras (Six Images) Per Timestep, After Resizing #
+image_shape = (128, 128, 3)
+batch_sizes = {"timestep": 6, "32 timesteps": 6 * 32}
+num_repeats = 5
+
+
+def images_per_second(augment_func, images):
+    augment_func(images)
+    start_time = time.time()
+    for _ in range(num_repeats):
+        augment_func(images)
+    return num_repeats * len(images) / (time.time() - start_time)
+
+
+pil_transform = T.Compose([T.ToPILImage(), T.AugMix()])
+
+
+def pil_augmix(images):
+    # Previous Path: One PIL Round Trip Per Image #
+    return np.stack([np.asarray(pil_transform(data)) for data in images])
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+
+    for batch_name, batch_size in batch_sizes.items():
+        images = rng.integers(0, 256, size=(batch_size, *image_shape), dtype=np.uint8)
+        severity = np.full(batch_size, 0.3)
+
+        benchmarks = {
+            "random resized crop": lambda x: random_resized_crop(x, rng),
+            "color jitter": lambda x: color_jitter(x, rng),
+            **{op_name: lambda x, op=op, severity=severity: op(x, severity, rng) for op_name, op in augmix_ops.items()},
+            "batched augmix": BatchAugmenter(seed=0).forward,
+            "crop + jitter + augmix": BatchAugmenter(crop_scale=(0.8, 1.0), color_jitter_kwargs={}, seed=0).forward,
+            "torchvision augmix (pil)": pil_augmix,
+        }
+
+        print("[*] Batch Of {0} Images ({1})".format(batch_size, batch_name))
+        for name, augment_func in benchmarks.items():
+            print("{0:>26}: {1:9.0f} images / s".format(name, images_per_second(augment_func, images)))
@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from copy import deepcopy
+
+import cv2
+import numpy as np
+
+from droid.camera_utils.recording_readers.mp4_reader import MP4Reader
+
+# Side-By-Side ZED Recording (Two 1280x720 Halves) #
+num_frames = 100
+frame_shape = (720, 2560, 3)
+serial_number = "12345678"
+
+reader_configs = {
+    "full resolution": dict(),
+    "resized": dict(resolution=(128, 128), resize_func="cv2"),
+    "resized (reused buffers)": dict(resolution=(128, 128), resize_func="cv2", reuse_buffers=True),
+}
+
+
+def write_recording(filepath):
+    base_frame = np.random.randint(0, 255, size=frame_shape, dtype=np.uint8)
+    video_writer = cv2.VideoWriter(filepath, cv2.VideoWriter_fourcc(*"mp4v"), 15, frame_shape[:2][::-1])
+    for i in range(num_frames):
+        video_writer.write(np.roll(base_frame, i * 8, axis=1))
+    video_writer.release()
+
+    with open(filepath[:-4] + "_timestamps.json", "w") as jsonFile:
+        json.dump(list(range(num_frames)), jsonFile)
+
+
+def legacy_process_frame(reader, frame):
+    # Previous MP4Reader._process_frame #
+    frame = deepcopy(frame)
+    if reader.resolution == (0, 0):
+        return frame
+    return reader.resize_func(frame, reader.resolution)
+
+
+def legacy_read_camera(reader):
+    _, frame = reader._mp4_reader.read()
+    single_width = frame.shape[1] // 2
+    return {
+        "image": {
+            reader.serial_number + "_left": legacy_process_frame(reader, frame[:, :single_width, :]),
+            reader.serial_number + "_right": legacy_process_frame(reader, frame[:, single_width:, :]),
+        }
+    }
+
+
+def profile_reader(filepath, reader_kwargs, read_func):
+    reader = MP4Reader(filepath, serial_number)
+    reader.set_reading_parameters(**reader_kwargs)
+
+    # Peak Traced Memory Above The Baseline Counts Every Temporary Frame Copy #
+    read_latency, peak_bytes = 0, 0
+    tracemalloc.start()
+    for _ in range(num_frames):
+        base_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        start_time = time.time()
+        read_func(reader)
+        read_latency += time.time() - start_time
+        peak_bytes += tracemalloc.get_traced_memory()[1] - base_bytes
+    tracemalloc.stop()
+
+    reader.disable_camera()
+    return read_latency / num_frames * 1e3, peak_bytes / num_frames / 2**20
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepath = os.path.join(temp_dir, serial_number + ".mp4")
+        write_recording(filepath)
+
+        for name, reader_kwargs in reader_configs.items():
+            legacy_kwargs = {key: value for key, value in reader_kwargs.items() if key != "reuse_buffers"}
+            results = {
+                "deepcopy": profile_reader(filepath, legacy_kwargs, legacy_read_camera),
+                "in place": profile_reader(filepath, reader_kwargs, lambda reader: reader.read_camera()),
+            }
+
+            for path, (latency, peak_mb) in results.items():
+                print(
+                    "{0:>24} | {1:>8}: {2:6.2f} ms / frame | {3:6.2f} MB allocated / frame".format(
+                        name, path, latency, peak_mb
+                    )
+                )
@@ -0,0 +1,82 @@
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from droid.data_loading.tf_data_loader import get_tf_dataloader
+
+# Synthetic TFRecords In The Format Written By scripts/convert/to_tfrecord.py #
+num_trajectories = 20
+trajectory_length = 100
+num_cameras = 2
+image_size = (180, 320)
+
+batch_size = 64
+shuffle_buffer_size = 1000
+num_batches = 100
+
+loader_configs = {
+    "decode per transition": dict(),
+    "decode after batching": dict(decode_after_batching=True),
+    "decode after batching (serial)": dict(decode_after_batching=True, decode_parallel_calls=1),
+}
+
+
+def tensor_feature(value):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[tf.io.serialize_tensor(value).numpy()]))
+
+
+def create_image():
+    # Smooth Random Images, So JPEG Sizes Are Closer To Real Frames Than Pure Noise #
+    low_res = np.random.randint(0, 255, size=(image_size[0] // 10, image_size[1] // 10, 3), dtype=np.uint8)
+    return tf.image.resize(low_res, image_size, method="bilinear")
+
+
+def write_tfrecords(folderpath):
+    with tf.io.TFRecordWriter(os.path.join(folderpath, "0.tfrecord")) as writer:
+        for _ in range(num_trajectories):
+            traj = {"action/cartesian_velocity": np.random.rand(trajectory_length, 6)}
+            for i in range(num_cameras):
+                images = [tf.io.encode_jpeg(tf.cast(create_image(), tf.uint8)) for _ in range(trajectory_length)]
+                traj["observation/image/{0}_left".format(i)] = images
+
+            features = {key: tensor_feature(value) for key, value in traj.items()}
+            writer.write(tf.train.Example(features=tf.train.Features(feature=features)).SerializeToString())
+
+
+def profile_loader(args):
+    # Runs In A Fresh Process, So ru_maxrss Is The Peak Of This Loader Alone #
+    folderpath, loader_kwargs = args
+    dataset = get_tf_dataloader(
+        folderpath, batch_size=batch_size, shuffle_buffer_size=shuffle_buffer_size, **loader_kwargs
+    )
+    iterator = dataset.as_numpy_iterator()
+
+    # Fill The Shuffle Buffer Before Timing #
+    next(iterator)
+
+    start_time = time.time()
+    for _ in range(num_batches):
+        next(iterator)
+    transitions_per_second = num_batches * batch_size / (time.time() - start_time)
+
+    return transitions_per_second, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as temp_dir:
+        write_tfrecords(temp_dir)
+        context = multiprocessing.get_context("spawn")
+
+        for name, loader_kwargs in loader_configs.items():
+            with context.Pool(1) as pool:
+                transitions_per_second, peak_rss_mb = pool.apply(profile_loader, ((temp_dir, loader_kwargs),))
+            print(
+                "{0:>32}: {1:7.0f} transitions / s | {2:7.0f} MB peak RSS".format(
+                    name, transitions_per_second, peak_rss_mb
+                )
+            )
@@ -0,0 +1,177 @@
+import time
+import tracemalloc
+from collections import defaultdict
+from copy import deepcopy
+from itertools import chain
+
+import numpy as np
+
+from droid.camera_utils.info import camera_type_to_string_dict
+from droid.data_processing.timestep_processing import TimestepProcesser
+
+# Three Stereo ZED Cameras At 720p (BGRA Frames) #
+num_calls = 50
+frame_shape = (720, 1280, 4)
+camera_types = {"11111111": 0, "22222222": 1, "33333333": 1}
+
+processer_configs = {
+    "no image transforms": dict(),
+    "remove alpha + bgr to rgb": dict(remove_alpha=True, bgr_to_rgb=True),
+    "fused float tensor": dict(remove_alpha=True, bgr_to_rgb=True, to_tensor=True),
+    "fused uint8 tensor": dict(remove_alpha=True, bgr_to_rgb=True, to_tensor=True, uint8_tensor=True),
+}
+
+
+def create_timestep():
+    observation = {
+        "robot_state": {
+            "cartesian_position": np.random.rand(6),
+            "gripper_position": np.random.rand(),
+            "joint_positions": np.random.rand(7),
+            "joint_velocities": np.random.rand(7),
+        },
+        "camera_type": camera_types,
+        "camera_extrinsics": {},
+        "camera_intrinsics": {},
+        "image": {},
+    }
+
+    for serial_number in camera_types:
+        for side in ["left", "right"]:
+            full_cam_id = "{0}_{1}".format(serial_number, side)
+            observation["camera_extrinsics"][full_cam_id] = np.random.rand(6)
+            observation["camera_intrinsics"][full_cam_id] = np.random.rand(3, 3)
+            observation["image"][full_cam_id] = np.random.randint(0, 255, size=frame_shape, dtype=np.uint8)
+
+    action = {"cartesian_velocity": np.random.rand(6), "gripper_velocity": np.random.rand()}
+    return {"observation": observation, "action": action}
+
+
+def legacy_forward(self, timestep):
+    # TimestepProcesser.forward Before The Deep Copy Was Dropped, Copied Verbatim (self Is The Processer) #
+    # Make Deep Copy #
+    timestep = deepcopy(timestep)
+
+    # Get Relevant Camera Info #
+    camera_type_dict = {k: camera_type_to_string_dict[v] for k, v in timestep["observation"]["camera_type"].items()}
+    sorted_camera_ids = sorted(camera_type_dict.keys())
+
+    ### Get Robot State Info ###
+    sorted_state_keys = sorted(self.robot_state_keys)
+    full_robot_state = timestep["observation"]["robot_state"]
+    robot_state = [np.array(full_robot_state[key]).flatten() for key in sorted_state_keys]
+    if len(robot_state):
+        robot_state = np.concatenate(robot_state)
+
+    ### Get Extrinsics ###
+    calibration_dict = timestep["observation"]["camera_extrinsics"]
+    sorted_calibrated_ids = sorted(calibration_dict.keys())
+    extrinsics_dict = defaultdict(list)
+
+    for serial_number in sorted_camera_ids:
+        cam_type = camera_type_dict[serial_number]
+        if cam_type not in self.camera_extrinsics:
+            continue
+
+        for full_cam_id in sorted_calibrated_ids:
+            if serial_number in full_cam_id:
+                cam2base = calibration_dict[full_cam_id]
+                extrinsics_dict[cam_type].append(cam2base)
+
+    sorted_extrinsics_keys = sorted(extrinsics_dict.keys())
+    extrinsics_state = list(chain(*[extrinsics_dict[cam_type] for cam_type in sorted_extrinsics_keys]))
+    if len(extrinsics_state):
+        extrinsics_state = np.concatenate(extrinsics_state)
+
+    ### Get Intrinsics ###
+    cam_intrinsics_obs = timestep["observation"]["camera_intrinsics"]
+    sorted_calibrated_ids = sorted(calibration_dict.keys())
+    intrinsics_dict = defaultdict(list)
+
+    for serial_number in sorted_camera_ids:
+        cam_type = camera_type_dict[serial_number]
+        if cam_type not in self.camera_extrinsics:
+            continue
+
+        full_cam_ids = sorted(cam_intrinsics_obs.keys())
+        for full_cam_id in full_cam_ids:
+            if serial_number in full_cam_id:
+                intr = cam_intrinsics_obs[full_cam_id]
+                intrinsics_dict[cam_type].append(intr)
+
+    sorted_intrinsics_keys = sorted(intrinsics_dict.keys())
+    intrinsics_state = list([np.array(intrinsics_dict[cam_type]).flatten() for cam_type in sorted_intrinsics_keys])
+    if len(intrinsics_state):
+        intrinsics_state = np.concatenate(intrinsics_state)
+
+    ### Get High Dimensional State Info ###
+    high_dim_state_dict = defaultdict(lambda: defaultdict(list))
+
+    for obs_type in ["image", "depth", "pointcloud"]:
+        obs_type_dict = timestep["observation"].get(obs_type, {})
+        sorted_obs_ids = sorted(obs_type_dict.keys())
+
+        for serial_number in sorted_camera_ids:
+            cam_type = camera_type_dict[serial_number]
+
+            for full_obs_id in sorted_obs_ids:
+                if serial_number in full_obs_id:
+                    data = obs_type_dict[full_obs_id]
+                    high_dim_state_dict[obs_type][cam_type].append(data)
+
+    ### Finish Observation Portion ###
+    low_level_state = np.concatenate([robot_state, extrinsics_state, intrinsics_state], dtype=self.state_dtype)
+    processed_timestep = {"observation": {"state": low_level_state, "camera": high_dim_state_dict}}
+    self.image_transformer.forward(processed_timestep)
+
+    ### Add Proper Action ###
+    if not self.ignore_action:
+        arm_action = timestep["action"][self.action_space]
+        gripper_action = timestep["action"][self.gripper_key]
+        action = np.concatenate([arm_action, [gripper_action]], dtype=self.action_dtype)
+        processed_timestep["action"] = action
+
+    # return raw information + meta data
+    processed_timestep["extrinsics_dict"] = extrinsics_dict
+    processed_timestep["intrinsics_dict"] = intrinsics_dict
+
+    return processed_timestep
+
+
+def profile_processer(processer, forward_func, timestep):
+    # Peak Traced Memory Above The Baseline Counts Every Temporary Copy #
+    latency, peak_bytes = 0, 0
+    tracemalloc.start()
+    for _ in range(num_calls):
+        base_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        start_time = time.time()
+        forward_func(processer, timestep)
+        latency += time.time() - start_time
+        peak_bytes += tracemalloc.get_traced_memory()[1] - base_bytes
+    tracemalloc.stop()
+
+    return latency / num_calls * 1e3, peak_bytes / num_calls / 2**20
+
+
+if __name__ == "__main__":
+    timestep = create_timestep()
+
+    for name, image_transform_kwargs in processer_configs.items():
+        processer = TimestepProcesser(gripper_action_space="velocity", image_transform_kwargs=image_transform_kwargs)
+
+        # Both Paths Must Agree #
+        legacy_state = legacy_forward(processer, timestep)["observation"]["state"]
+        assert np.array_equal(legacy_state, processer.forward(timestep)["observation"]["state"])
+
+        results = {
+            "deepcopy": profile_processer(processer, legacy_forward, timestep),
+            "no copy": profile_processer(processer, lambda p, t: p.forward(t), timestep),
+        }
+
+        for path, (latency, peak_mb) in results.items():
+            print(
+                "{0:>26} | {1:>8}: {2:7.3f} ms / call | {3:6.2f} MB allocated / call".format(
+                    name, path, latency, peak_mb
+                )
+            )
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+from benchmark_trajectory_writer import create_timestep
+
+from droid.trajectory_utils.trajectory_reader import TrajectoryReader, load_hdf5_to_dict
+from droid.trajectory_utils.trajectory_writer import TrajectoryWriter
+
+num_timesteps = 500
+num_repeats = 3
+
+
+def time_per_timestep(read_func):
+    start_time = time.time()
+    for _ in range(num_repeats):
+        read_func()
+    return (time.time() - start_time) / (num_repeats * num_timesteps) * 1e6
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepath = os.path.join(temp_dir, "trajectory.h5")
+
+        # Write Synthetic Trajectory #
+        traj_writer = TrajectoryWriter(filepath, save_images=False, buffered=True)
+        for i in range(num_timesteps):
+            traj_writer.write_timestep(create_timestep(i))
+        traj_writer.close()
+
+        # Recursive Walk Per Timestep (Previous TrajectoryReader) #
+        hdf5_file = h5py.File(filepath, "r")
+        walk_latency = time_per_timestep(
+            lambda: [load_hdf5_to_dict(hdf5_file, i, keys_to_ignore=["videos"]) for i in range(num_timesteps)]
+        )
+        hdf5_file.close()
+
+        # Cached Index Per Timestep #
+        traj_reader = TrajectoryReader(filepath, read_images=False)
+        index_latency = time_per_timestep(lambda: [traj_reader.read_timestep(index=i) for i in range(num_timesteps)])
+
+        # Cached Index, One Read Per Dataset #
+        bulk_latency = time_per_timestep(lambda: traj_reader.read_indices(np.arange(num_timesteps)))
+        traj_reader.close()
+
+    print("Recursive walk: {0:8.1f} us / timestep".format(walk_latency))
+    print("Cached index:   {0:8.1f} us / timestep".format(index_latency))
+    print("Bulk read:      {0:8.1f} us / timestep".format(bulk_latency))
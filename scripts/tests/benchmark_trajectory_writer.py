@@ -0,0 +1,102 @@
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from droid.trajectory_utils.trajectory_writer import TrajectoryWriter, write_dict_to_hdf5
+
+# Roughly matches a real DROID timestep (~60 leaf keys) #
+num_timesteps = 1000
+camera_ids = ["13062452", "20521388", "24259877"]
+
+writer_configs = {
+    "legacy": None,
+    "per-timestep": dict(buffered=False),
+    "buffered": dict(buffered=True),
+    "buffered (gzip)": dict(buffered=True, buffer_kwargs=dict(compression="gzip", compression_opts=4)),
+}
+
+
+def create_timestep(i):
+    robot_state = {
+        "cartesian_position": np.random.randn(6),
+        "gripper_position": np.random.rand(),
+        "joint_positions": np.random.randn(7),
+        "joint_velocities": np.random.randn(7),
+        "joint_torques_computed": np.random.randn(7),
+        "prev_joint_torques_computed": np.random.randn(7),
+        "prev_joint_torques_computed_safened": np.random.randn(7),
+        "motor_torques_measured": np.random.randn(7),
+        "prev_controller_latency_ms": np.random.rand(),
+        "prev_command_successful": True,
+    }
+    camera_timestamps = {}
+    for cam_id in camera_ids:
+        for key in ["estimated_capture", "frame_received", "read_start", "read_end"]:
+            camera_timestamps[cam_id + "_" + key] = i * 66 + np.random.randint(10)
+
+    observation = {
+        "robot_state": robot_state,
+        "camera_type": {cam_id: int(cam_id == camera_ids[0]) for cam_id in camera_ids},
+        "camera_extrinsics": {
+            cam_id + side: np.random.randn(6) for cam_id in camera_ids for side in ["_left", "_right"]
+        },
+        "controller_info": {"movement_enabled": True, "controller_on": True, "success": False, "failure": False},
+        "timestamp": {
+            "cameras": camera_timestamps,
+            "robot_state": {"read_start": i * 66, "read_end": i * 66 + 1},
+            "control": {
+                key: i * 66 for key in ["step_start", "policy_start", "sleep_start", "control_start", "step_end"]
+            },
+            "skip_action": False,
+        },
+    }
+    action = {
+        "cartesian_position": np.random.randn(6),
+        "cartesian_velocity": np.random.randn(6),
+        "joint_position": np.random.randn(7),
+        "joint_velocity": np.random.randn(7),
+        "gripper_position": np.random.rand(),
+        "gripper_velocity": np.random.rand(),
+        "target_cartesian_position": np.random.randn(6),
+        "target_gripper_position": np.random.rand(),
+        "robot_state": robot_state,
+    }
+
+    return {"observation": observation, "action": action}
+
+
+def write_trajectory(filepath, timesteps, writer_kwargs):
+    # Recursive Dictionary Walk, One Resize Per Key Per Timestep #
+    if writer_kwargs is None:
+        with h5py.File(filepath, "w") as hdf5_file:
+            for timestep in timesteps:
+                write_dict_to_hdf5(hdf5_file, timestep)
+        return
+
+    traj_writer = TrajectoryWriter(filepath, save_images=False, **writer_kwargs)
+    for timestep in timesteps:
+        traj_writer.write_timestep(timestep)
+    traj_writer.close()
+
+
+if __name__ == "__main__":
+    timesteps = [create_timestep(i) for i in range(num_timesteps)]
+
+    for name, writer_kwargs in writer_configs.items():
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filepath = os.path.join(temp_dir, "trajectory.h5")
+
+            start_time = time.time()
+            write_trajectory(filepath, timesteps, writer_kwargs)
+            total_time = time.time() - start_time
+
+            file_size = os.path.getsize(filepath)
+
+        print(
+            "{0:>16}: {1:8.1f} timesteps/sec | {2:7.3f} sec total | {3:8.1f} KB".format(
+                name, num_timesteps / total_time, total_time, file_size / 1024
+            )
+        )
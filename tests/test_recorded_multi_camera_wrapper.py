@@ -0,0 +1,86 @@
+import json
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from droid.camera_utils.wrappers.recorded_multi_camera_wrapper import RecordedMultiCameraWrapper
+
+num_frames = 5
+frame_shape = (16, 32, 3)
+camera_type_dict = {"11111111": "varied_camera", "22222222": "varied_camera"}
+
+
+def write_recording(folderpath, serial_number, length):
+    filepath = os.path.join(folderpath, serial_number + ".mp4")
+    writer = cv2.VideoWriter(filepath, cv2.VideoWriter_fourcc(*"mp4v"), 15, (frame_shape[1], frame_shape[0]))
+    for i in range(length):
+        writer.write(np.full(frame_shape, 40 * i, dtype=np.uint8))
+    writer.release()
+
+    with open(os.path.join(folderpath, serial_number + "_timestamps.json"), "w") as jsonFile:
+        json.dump([100 * i for i in range(length)], jsonFile)
+
+
+@pytest.fixture
+def camera_reader(tmp_path):
+    # The Second Recording Ends Early #
+    write_recording(str(tmp_path), "11111111", num_frames)
+    write_recording(str(tmp_path), "22222222", num_frames - 2)
+    camera_reader = RecordedMultiCameraWrapper(str(tmp_path))
+    yield camera_reader
+    camera_reader.disable_cameras()
+
+
+def get_timestamp_dict(timestamps):
+    return {serial_number + "_frame_received": timestamps for serial_number in camera_type_dict}
+
+
+def test_read_frames_aligned(camera_reader):
+    camera_obs, keep_mask = camera_reader.read_frames(
+        [0, 2], camera_type_dict=camera_type_dict, timestamp_dict=get_timestamp_dict(np.array([0, 200]))
+    )
+    assert keep_mask.tolist() == [True, True]
+    assert sorted(camera_obs["image"]) == ["11111111_left", "11111111_right", "22222222_left", "22222222_right"]
+    assert all(len(frames) == 2 for frames in camera_obs["image"].values())
+
+
+def test_read_frames_past_end_of_recording(camera_reader):
+    camera_obs, keep_mask = camera_reader.read_frames(
+        [1, 4], camera_type_dict=camera_type_dict, timestamp_dict=get_timestamp_dict(np.array([100, 400]))
+    )
+    assert keep_mask.tolist() == [True, False]
+    assert all(len(frames) == 1 for frames in camera_obs["image"].values())
+
+
+def test_read_frames_without_any_aligned_frame(camera_reader):
+    # Only Index Past The End Of One Recording #
+    camera_obs, keep_mask = camera_reader.read_frames(
+        [4], camera_type_dict=camera_type_dict, timestamp_dict=get_timestamp_dict(np.array([400]))
+    )
+    assert keep_mask.tolist() == [False]
+    assert all(len(frames) == 0 for frames in camera_obs["image"].values())
+
+    # Timestamp Mismatch #
+    camera_obs, keep_mask = camera_reader.read_frames(
+        [1], camera_type_dict=camera_type_dict, timestamp_dict=get_timestamp_dict(np.array([150]))
+    )
+    assert keep_mask.tolist() == [False]
+    assert all(len(frames) == 0 for frames in camera_obs["image"].values())
+
+
+def test_read_frames_without_timestamps(camera_reader):
+    camera_obs, keep_mask = camera_reader.read_frames([3], camera_type_dict=camera_type_dict)
+    assert keep_mask.tolist() == [False]
+    assert all(len(frames) == 0 for frames in camera_obs["image"].values())
+
+
+@pytest.mark.parametrize("indices,timestamps", [([0, 2], [0, 200]), ([1, 4], [100, 400]), ([1, 2], [150, 200])])
+def test_keep_mask_matches_read_frames(camera_reader, indices, timestamps):
+    timestamp_dict = get_timestamp_dict(np.array(timestamps))
+    keep_mask = camera_reader.get_keep_mask(indices, camera_type_dict=camera_type_dict, timestamp_dict=timestamp_dict)
+    _, read_keep_mask = camera_reader.read_frames(
+        indices, camera_type_dict=camera_type_dict, timestamp_dict=timestamp_dict
+    )
+    assert keep_mask.tolist() == read_keep_mask.tolist()
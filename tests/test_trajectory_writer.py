@@ -0,0 +1,48 @@
+import os
+import time
+
+import h5py
+import numpy as np
+
+from droid.trajectory_utils.trajectory_reader import EmbeddedVideoDecoder
+from droid.trajectory_utils.trajectory_writer import HDF5VideoWriter
+
+frame_shape = (64, 96, 3)
+fps = 10
+
+
+def create_frame(i):
+    frame = np.full(frame_shape, (3 * i) % 256, dtype=np.uint8)
+    frame[:, i % frame_shape[1]] = 255
+    return frame
+
+
+def wait_for_bytes(dataset, timeout_sec=10):
+    end_time = time.time() + timeout_sec
+    while (dataset.shape[0] == 0) and (time.time() < end_time):
+        time.sleep(0.05)
+    return dataset.shape[0]
+
+
+def test_video_streams_before_close(tmp_path):
+    with h5py.File(tmp_path / "trajectory.h5", "w") as hdf5_file:
+        dataset = hdf5_file.create_dataset("video", (0,), maxshape=(None,), dtype=np.uint8, chunks=(2**16,))
+        dataset.attrs["frame_shape"] = frame_shape
+        video_writer = HDF5VideoWriter(dataset, os.path.join(tmp_path, "video.mp4"), fps=fps)
+
+        # Several Fragments Worth Of Frames Must Reach HDF5 While Recording #
+        num_frames = 12 * fps
+        for i in range(num_frames):
+            video_writer.append_data(create_frame(i))
+        streamed_bytes = wait_for_bytes(dataset)
+        video_writer.close()
+
+        assert 0 < streamed_bytes < dataset.shape[0]
+
+        # The Streamed Video Decodes Back To Every Frame #
+        decoder = EmbeddedVideoDecoder(dataset)
+        num_decoded = 0
+        while decoder.read_frame() is not None:
+            num_decoded += 1
+        decoder.close()
+        assert num_decoded == num_frames